@@ -0,0 +1,238 @@
+"""End-to-end benchmark of the citemachine pipeline on a synthetic corpus
+
+Times every stage of the pipeline, from parsing the DBLP file to answering
+CiteMachine queries, and writes throughput, query latency percentiles and
+peak RSS to a JSON file. When given a baseline result file, stages that got
+slower than the tolerance allows are reported and the exit code is 1. A
+baseline run with a different corpus size, number of topics or number of
+queries is refused with exit code 2.
+
+Usage:
+    python benchmarks/bench_pipeline.py --scale small --output results.json
+    python benchmarks/bench_pipeline.py --baseline results.json
+"""
+from __future__ import division
+
+import argparse
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from citemachine import topic_model
+from citemachine.corpus.dblp import DBLP
+from citemachine.corpus.synthetic import SCALES, generate_dblp
+from citemachine.graph import CommunityRank, adj_lists_to_directed_graph
+from citemachine.recommender import LDARecommender, CiteMachine
+from citemachine.text_process import CorpusPreprocessor
+
+
+# runs that differ in these parameters can not be compared
+COMPARED_CONFIG = ('num_docs', 'num_topics', 'num_queries')
+
+
+def peak_rss_mb():
+    """Peak resident set size of the process so far, in megabytes"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on OS X and in kilobytes on Linux
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+
+
+class Benchmark(object):
+
+    def __init__(self):
+        self.stages = {}
+        self.queries = {}
+
+    def stage(self, name, func, num_items):
+        """Runs func once, recording its wall time and the throughput of
+        num_items, which can be a number or a function of func's result
+
+        The peak RSS of the process only ever grows, so a stage records the
+        cumulative peak after it ran and by how much it raised the peak,
+        which is zero for stages that stayed below an earlier stage's peak.
+        """
+        rss_before = peak_rss_mb()
+        start = time.time()
+        result = func()
+        seconds = time.time() - start
+        rss_after = peak_rss_mb()
+
+        if callable(num_items):
+            num_items = num_items(result)
+        self.stages[name] = {'seconds': seconds, 'items': num_items,
+                             'throughput': num_items / seconds,
+                             'cumulative_peak_rss_mb': rss_after,
+                             'peak_rss_growth_mb': rss_after - rss_before}
+        print '{name:>20}: {seconds:8.2f}s {throughput:10.1f} items/s'.format(
+            name=name, **self.stages[name])
+        return result
+
+    def query_latency(self, name, func, queries):
+        """Calls func on every query, recording latency percentiles"""
+        latencies = []
+        for query in queries:
+            start = time.time()
+            func(query)
+            latencies.append(time.time() - start)
+
+        latencies = np.array(latencies) * 1000
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+        self.queries[name] = {'count': len(latencies),
+                              'mean_ms': latencies.mean(),
+                              'p50_ms': p50, 'p95_ms': p95, 'p99_ms': p99,
+                              'throughput': 1000 * len(latencies) /
+                              latencies.sum()}
+        print '{name:>20}: p50 {p50_ms:8.2f}ms p95 {p95_ms:8.2f}ms'.format(
+            name=name, **self.queries[name])
+
+
+def run(num_docs, num_topics=50, num_queries=100, seed=0, workdir=None):
+    bench = Benchmark()
+    workdir = workdir or tempfile.mkdtemp(prefix='citemachine_bench_')
+    if not os.path.isdir(workdir):
+        os.makedirs(workdir)
+    corpus_path = os.path.join(workdir, 'dblp_{n}_{seed}.txt'.format(
+        n=num_docs, seed=seed))
+
+    if not os.path.exists(corpus_path):
+        generate_dblp(corpus_path, num_docs=num_docs, seed=seed)
+
+    dblp = bench.stage('parse', lambda: DBLP(corpus_path),
+                       lambda corpus: len(corpus.keys()))
+    preprocessor = bench.stage('preprocess', lambda: CorpusPreprocessor(dblp),
+                               len(dblp.keys()))
+    recommender = bench.stage('train',
+                              lambda: LDARecommender(dblp, preprocessor,
+                                                     num_topics=num_topics,
+                                                     train_at_init=True),
+                              len(dblp.keys()))
+
+    rs = np.random.RandomState(seed)
+    query_docs = [dblp.keys()[i] for i in
+                  rs.choice(len(dblp.keys()), num_queries, replace=False)]
+    query_texts = [dblp.texts[doc] for doc in query_docs]
+
+    bench.query_latency('score_topics',
+                        lambda doc: topic_model.score_topics(
+                            recommender.topics[doc], recommender.topics),
+                        query_docs)
+    bench.query_latency('top_scoring_for_doc',
+                        lambda doc: recommender.top_scoring_for_doc(doc, 10),
+                        query_docs)
+
+    communityrank = bench.stage(
+        'community_rank',
+        lambda: CommunityRank(adj_lists_to_directed_graph(dblp.references)),
+        len(dblp.keys()))
+    citemachine = bench.stage('citemachine',
+                              lambda: CiteMachine(recommender, communityrank),
+                              lambda cm: len(cm.community_topics))
+
+    recommender.query_cache.clear()
+    bench.query_latency('citemachine_query',
+                        citemachine.get_recommended_docs_for_text,
+                        query_texts)
+
+    return {'config': {'num_docs': num_docs, 'num_topics': num_topics,
+                       'num_queries': num_queries, 'seed': seed,
+                       'python': platform.python_version(),
+                       'machine': platform.machine()},
+            'stages': bench.stages,
+            'queries': bench.queries,
+            'peak_rss_mb': peak_rss_mb()}
+
+
+def config_differences(config, baseline_config):
+    """Lists the parameters that make two runs incomparable"""
+    return ['{name}: {old} -> {new}'.format(name=name,
+                                             old=baseline_config.get(name),
+                                             new=config.get(name))
+            for name in COMPARED_CONFIG
+            if config.get(name) != baseline_config.get(name)]
+
+
+def find_regressions(results, baseline, tolerance=0.2):
+    """Lists the stages and queries that are more than tolerance (relative)
+    slower than in the baseline
+
+    Raises:
+        ValueError: if the runs used different corpus sizes, numbers of
+                topics or numbers of queries
+    """
+    differences = config_differences(results['config'],
+                                     baseline.get('config', {}))
+    if differences:
+        raise ValueError('Baseline is not comparable, ' +
+                         ', '.join(differences))
+
+    regressions = []
+    for section, metric in (('stages', 'seconds'), ('queries', 'p95_ms')):
+        for name, old in baseline.get(section, {}).items():
+            new = results[section].get(name)
+            if new is None:
+                continue
+            if new[metric] > old[metric] * (1 + tolerance):
+                regressions.append('{name} {metric}: {old:.3f} -> {new:.3f}'
+                                   .format(name=name, metric=metric,
+                                           old=old[metric], new=new[metric]))
+
+    old_rss, new_rss = baseline.get('peak_rss_mb'), results['peak_rss_mb']
+    if old_rss and new_rss > old_rss * (1 + tolerance):
+        regressions.append('peak_rss_mb: {old:.1f} -> {new:.1f}'.format(
+            old=old_rss, new=new_rss))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--scale', choices=sorted(SCALES), default='small')
+    parser.add_argument('--docs', type=int,
+                        help='number of documents, overrides --scale')
+    parser.add_argument('--topics', type=int, default=50)
+    parser.add_argument('--queries', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workdir', help='where generated corpora are kept')
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--baseline', help='results file to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed relative slowdown against the baseline')
+    args = parser.parse_args(argv)
+
+    num_docs = args.docs or SCALES[args.scale]
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        # checked before running, so that a mismatch fails fast
+        differences = config_differences(
+            {'num_docs': num_docs, 'num_topics': args.topics,
+             'num_queries': args.queries}, baseline.get('config', {}))
+        if differences:
+            print 'Baseline is not comparable:', ', '.join(differences)
+            return 2
+
+    results = run(num_docs, num_topics=args.topics,
+                  num_queries=args.queries, seed=args.seed,
+                  workdir=args.workdir)
+
+    with open(args.output, 'w') as output:
+        json.dump(results, output, indent=2, sort_keys=True)
+
+    if baseline is not None:
+        regressions = find_regressions(results, baseline, args.tolerance)
+        for regression in regressions:
+            print 'REGRESSION', regression
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,3 @@
+from citemachine.cli import main
+
+main()
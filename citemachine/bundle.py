@@ -0,0 +1,442 @@
+"""Directory based model bundle, a memory-mapped alternative to pickling a
+whole LDARecommender
+
+A bundle directory contains:
+
+    manifest.json:       format version, number of topics and documents and
+                         the fingerprint checked by neighbour tables
+    vocabulary.json:     preprocessed word -> word id of the valid words
+    titles.json:         document titles, in row order
+    doc_ids.npy:         (N,) document ids, sorted, defines the row order
+    topic_matrix.npy:    (N, num_topics) document topic vectors
+    years.npy:           (N,) publication years, 0 if unknown
+    citation_counts.npy: (N,) citation counts
+    topic_word.npy:      (num_topics, num_words) the LDA's expElogbeta
+    alpha.npy:           (num_topics,) the LDA's topic priors
+    reference_indptr.npy / reference_ids.npy:
+                         references of every document in compressed sparse
+                         row layout, the references of row i are
+                         reference_ids[reference_indptr[i]:
+                                       reference_indptr[i + 1]]
+    facets/authors/:     optional author FacetIndex of the corpus
+    facets/venues/:      optional venue FacetIndex of the corpus
+
+The arrays are opened with memory-mapping, so loading is nearly instant and
+worker processes serving the same bundle share its pages through the OS
+cache.
+"""
+from __future__ import division
+
+import json
+import os
+import time
+from collections import Counter
+from datetime import date
+
+import numpy as np
+
+from citemachine import instrument
+from citemachine import neighbours
+from citemachine import topic_model
+from citemachine.corpus.facets import FacetIndex, Facets
+from citemachine.neighbours import NeighbourTable
+from citemachine.util import LRUCache
+
+
+FORMAT_VERSION = 1
+
+MANIFEST_FILE = 'manifest.json'
+VOCABULARY_FILE = 'vocabulary.json'
+TITLES_FILE = 'titles.json'
+AUTHOR_INDEX_DIR = os.path.join('facets', 'authors')
+VENUE_INDEX_DIR = os.path.join('facets', 'venues')
+
+
+def save_bundle(recommender, path):
+    """Writes a trained LDARecommender to a bundle directory
+
+    Args:
+        recommender: trained LDARecommender
+        path: directory to write the bundle to, created if missing
+    """
+    if not os.path.isdir(path):
+        os.makedirs(path)
+
+    corpus = recommender.corpus
+    preprocessor = recommender.preprocessor
+    lda = recommender.LDA
+
+    doc_ids = sorted(recommender.topics.keys())
+    _, topic_matrix = topic_model.topics_dict_to_matrix(recommender.topics,
+                                                        recommender.num_topics,
+                                                        doc_ids)
+
+    years = np.array([corpus.years[doc] or 0 for doc in doc_ids],
+                     dtype=np.int32)
+    citation_counts = np.array([corpus.citation_counts[doc]
+                                for doc in doc_ids], dtype=np.int32)
+    _save_array(path, 'doc_ids', np.asarray(doc_ids, dtype=np.int64))
+    _save_array(path, 'topic_matrix', topic_matrix)
+    _save_array(path, 'years', years)
+    _save_array(path, 'citation_counts', citation_counts)
+
+    references = [corpus.references.get(doc) or [] for doc in doc_ids]
+    reference_indptr = np.zeros(len(doc_ids) + 1, dtype=np.int64)
+    reference_indptr[1:] = np.cumsum([len(refs) for refs in references])
+    _save_array(path, 'reference_indptr', reference_indptr)
+    _save_array(path, 'reference_ids',
+                np.fromiter((ref for refs in references for ref in refs),
+                            dtype=np.int64, count=reference_indptr[-1]))
+    _save_array(path, 'topic_word', lda.expElogbeta.astype(np.float32))
+    _save_array(path, 'alpha', np.asarray(lda.alpha, dtype=np.float64))
+
+    vocabulary = {word: preprocessor.to_id(word)
+                  for word in preprocessor._valid_words}
+    with open(os.path.join(path, VOCABULARY_FILE), 'w') as vocabulary_file:
+        json.dump(vocabulary, vocabulary_file)
+
+    with open(os.path.join(path, TITLES_FILE), 'w') as titles_file:
+        json.dump([corpus.titles[doc] for doc in doc_ids], titles_file)
+
+    if hasattr(corpus, 'author_index') and hasattr(corpus, 'venue_index'):
+        corpus.author_index.save(os.path.join(path, AUTHOR_INDEX_DIR))
+        corpus.venue_index.save(os.path.join(path, VENUE_INDEX_DIR))
+
+    # the manifest is written last, a bundle without one is incomplete
+    manifest = {'format_version': FORMAT_VERSION,
+                'fingerprint': neighbours.fingerprint(doc_ids, topic_matrix,
+                                                      years, citation_counts),
+                'num_topics': recommender.num_topics,
+                'num_docs': len(doc_ids),
+                'num_words': int(lda.expElogbeta.shape[1]),
+                'min_probability': getattr(lda, 'minimum_probability', 0.01)}
+    with open(os.path.join(path, MANIFEST_FILE), 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+
+
+def load_bundle(path, **kwargs):
+    """Opens a bundle directory, see ModelBundle for keyword arguments"""
+    return ModelBundle(path, **kwargs)
+
+
+class ModelBundle(object):
+    """Recommender served from a bundle directory
+
+    Provides the querying methods of LDARecommender. Arrays are
+    memory-mapped and the vocabulary and titles are only read on first use.
+    """
+
+    def __init__(self, path, tokenize=None, stemmer=None,
+                 query_cache_size=1024):
+        """
+        Args:
+            path: bundle directory written by 'save_bundle'
+            tokenize / stemmer: text preprocessing tools, should match the
+                    ones of the CorpusPreprocessor the model was trained with,
+                    default to nltk's word_tokenize and LancasterStemmer
+            query_cache_size: number of query texts whose topic vectors are
+                    kept
+        """
+        with open(os.path.join(path, MANIFEST_FILE)) as manifest_file:
+            self.manifest = json.load(manifest_file)
+
+        if self.manifest['format_version'] != FORMAT_VERSION:
+            raise ValueError('Unsupported bundle format version: {version}'
+                             .format(version=self.manifest['format_version']))
+
+        self.path = path
+        self.num_topics = self.manifest['num_topics']
+        self.tokenize = tokenize
+        self.stemmer = stemmer
+        self.query_cache = LRUCache(query_cache_size)
+        self.neighbour_table = None
+
+        self.doc_ids = self._load_array('doc_ids')
+        self.topic_matrix = self._load_array('topic_matrix')
+        self.years = self._load_array('years')
+        self.citation_counts = self._load_array('citation_counts')
+        self.topic_word = self._load_array('topic_word')
+        self.alpha = self._load_array('alpha')
+
+        self._vocabulary = None
+        self._titles = None
+        self._facets = None
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    def __contains__(self, doc_id):
+        row = np.searchsorted(self.doc_ids, doc_id)
+        return row < len(self.doc_ids) and self.doc_ids[row] == doc_id
+
+    @property
+    def vocabulary(self):
+        """Dictionary from preprocessed word to word id"""
+        if self._vocabulary is None:
+            with open(os.path.join(self.path, VOCABULARY_FILE)) as vocab_file:
+                self._vocabulary = json.load(vocab_file)
+        return self._vocabulary
+
+    @property
+    def titles(self):
+        """List of document titles, in row order"""
+        if self._titles is None:
+            with open(os.path.join(self.path, TITLES_FILE)) as titles_file:
+                self._titles = json.load(titles_file)
+        return self._titles
+
+    @property
+    def facets(self):
+        """Author and venue filters aligned with the bundle's rows"""
+        if self._facets is None:
+            author_path = os.path.join(self.path, AUTHOR_INDEX_DIR)
+            venue_path = os.path.join(self.path, VENUE_INDEX_DIR)
+            if not os.path.isdir(author_path) or \
+                    not os.path.isdir(venue_path):
+                raise ValueError('Bundle {path} has no facet indexes'
+                                 .format(path=self.path))
+            self._facets = Facets(FacetIndex.load(author_path),
+                                  FacetIndex.load(venue_path), self.doc_ids)
+        return self._facets
+
+    @property
+    def references(self):
+        """Read-only mapping from document id to the ids of its references,
+        used by evaluation.evaluate"""
+        if not os.path.exists(os.path.join(self.path,
+                                           'reference_indptr.npy')):
+            raise ValueError('Bundle {path} has no references, pass them to '
+                             'evaluate explicitly'.format(path=self.path))
+        return BundleReferences(self.doc_ids,
+                                self._load_array('reference_indptr'),
+                                self._load_array('reference_ids'))
+
+    def row_of(self, doc_id):
+        """Returns the row of a document in the bundle's arrays"""
+        row = np.searchsorted(self.doc_ids, doc_id)
+        if row >= len(self.doc_ids) or self.doc_ids[row] != doc_id:
+            raise KeyError(doc_id)
+        return int(row)
+
+    def title(self, doc_id):
+        return self.titles[self.row_of(doc_id)]
+
+    def load_neighbour_table(self, path):
+        """Uses a previously built neighbour table for 'top_scoring_for_doc',
+        raises a ValueError if the table is incomplete or was built for a
+        different model"""
+        fingerprint = self.manifest.get('fingerprint')
+        if fingerprint is None:
+            # bundles written before fingerprints were stored
+            fingerprint = neighbours.fingerprint(self.doc_ids,
+                                                 self.topic_matrix,
+                                                 self.years,
+                                                 self.citation_counts)
+
+        table = NeighbourTable(path)
+        table.verify(fingerprint)
+        self.neighbour_table = table
+        return table
+
+    def text_to_number_encoding(self, text):
+        """Turns a string of text into a number encoded word vector, using
+        the vocabulary of the bundle"""
+        if self.tokenize is None:
+            from nltk import word_tokenize
+            self.tokenize = word_tokenize
+        if self.stemmer is None:
+            from nltk.stem.lancaster import LancasterStemmer
+            self.stemmer = LancasterStemmer()
+
+        vocabulary = self.vocabulary
+        stem = self.stemmer.stem
+        words = (stem(word.rstrip('.')) for word in self.tokenize(text))
+        return Counter(vocabulary[word] for word in words
+                       if word in vocabulary).most_common()
+
+    @instrument.timed('bundle.text_to_topic_vector')
+    def text_to_topic_vector(self, text):
+        topic_vector = self.query_cache.get(text)
+        if topic_vector is None:
+            bow = self.text_to_number_encoding(text)
+            topic_vector = self.infer_topic_vectors([bow])[0]
+            self.query_cache.put(text, topic_vector)
+        return topic_vector
+
+    def texts_to_topic_vectors(self, texts, record=None):
+        """Batched version of 'text_to_topic_vector', see LDARecommender's
+        'texts_to_topic_vectors'"""
+        cache = self.query_cache
+        start = time.time()
+        topic_vectors = [cache.get(text) for text in texts]
+        missing = [i for i, topic_vector in enumerate(topic_vectors)
+                   if topic_vector is None]
+
+        bows = [self.text_to_number_encoding(texts[i]) for i in missing]
+        encoded = time.time()
+        for i, topic_vector in zip(missing, self.infer_topic_vectors(bows)):
+            topic_vectors[i] = topic_vector
+            cache.put(texts[i], topic_vector)
+
+        if record is not None:
+            record('encode', encoded - start)
+            record('infer', time.time() - encoded)
+        return topic_vectors
+
+    def infer_topic_vectors(self, bows):
+        """Infers the topic vectors of a list of number encoded texts"""
+        min_probability = self.manifest['min_probability']
+        return [topic_model.infer_topics(bow, self.alpha, self.topic_word,
+                                         min_probability=min_probability)
+                for bow in bows]
+
+    @instrument.timed('bundle.top_scoring_for_topics')
+    def top_scoring_for_topics(self, topic_vector, publication_year=None,
+                               num_results=None, **facet_filters):
+
+        if facet_filters:
+            return self.top_scoring_for_topic_vectors([topic_vector],
+                                                      [publication_year],
+                                                      num_results,
+                                                      **facet_filters)[0]
+
+        if publication_year is None:
+            publication_year = date.today().year
+
+        query = topic_model.topics_to_dense(topic_vector, self.num_topics)
+        scores = topic_model.histogram_intersection_scores(query,
+                                                           self.topic_matrix)
+
+        is_valid = (self.years <= publication_year) & \
+                   (self.citation_counts > 0)
+        scores[~is_valid] = -np.inf
+
+        if num_results is None:
+            num_results = int(is_valid.sum())
+        top = topic_model.top_k_indices(scores, num_results)
+
+        doc_ids = self.doc_ids
+        return [(int(doc_ids[row]), float(scores[row])) for row in top
+                if is_valid[row]]
+
+    def top_scoring_for_topic_vectors(self, topic_vectors,
+                                      publication_years=None,
+                                      num_results=10, venues=None,
+                                      exclude_authors=None,
+                                      boost_venues=None, venue_boost=1.5):
+        """Scores a batch of topic vectors against the corpus in one pass,
+        see LDARecommender's 'top_scoring_for_topic_vectors'"""
+        row_mask = row_weights = None
+        if venues is not None or exclude_authors or boost_venues:
+            row_mask = self.facets.mask(venues, exclude_authors)
+            row_weights = self.facets.weights(boost_venues, venue_boost)
+
+        query_matrix = np.vstack([topic_model.topics_to_dense(topic_vector,
+                                                              self.num_topics)
+                                  for topic_vector in topic_vectors])
+        results = topic_model.top_scoring_batch(
+            query_matrix, self.topic_matrix, self.doc_ids, self.years,
+            self.citation_counts,
+            topic_model.year_cutoffs(publication_years, len(topic_vectors)),
+            num_results, row_mask=row_mask, row_weights=row_weights)
+        return [[(int(doc), score) for doc, score in doc_scores]
+                for doc_scores in results]
+
+    def top_scoring_for_doc(self, doc_id, num_results=None, **facet_filters):
+
+        table = self.neighbour_table
+        if table is not None and not facet_filters and \
+                num_results is not None and num_results <= table.k and \
+                doc_id in table:
+            return table.lookup(doc_id, num_results)
+
+        row = self.row_of(doc_id)
+        topic_vector = [(topic, prob) for topic, prob
+                        in enumerate(self.topic_matrix[row].tolist())
+                        if prob > 0]
+        return self.top_scoring_for_topics(topic_vector,
+                                           int(self.years[row]) or None,
+                                           num_results,
+                                           **facet_filters)
+
+    def top_scoring_for_docs(self, doc_ids, num_results=10):
+        """Batched version of 'top_scoring_for_doc'"""
+        table = self.neighbour_table
+        if table is not None and num_results <= table.k and \
+                all(doc_id in table for doc_id in doc_ids):
+            return [table.lookup(doc_id, num_results) for doc_id in doc_ids]
+
+        rows = [self.row_of(doc_id) for doc_id in doc_ids]
+        results = topic_model.top_scoring_batch(
+            self.topic_matrix[rows], self.topic_matrix, self.doc_ids,
+            self.years, self.citation_counts,
+            topic_model.document_year_cutoffs(self.years[rows]), num_results)
+        return [[(int(doc), score) for doc, score in doc_scores]
+                for doc_scores in results]
+
+    def top_scoring_for_text(self, text, publication_year=None,
+                             num_results=None, **facet_filters):
+
+        topic_vector = self.text_to_topic_vector(text)
+        return self.top_scoring_for_topics(topic_vector,
+                                           publication_year,
+                                           num_results,
+                                           **facet_filters)
+
+    def top_scoring_for_texts(self, texts, publication_years=None,
+                              num_results=10, **facet_filters):
+        """Batched version of 'top_scoring_for_text'
+
+        Args:
+            texts: list of query texts
+            publication_years: list with the year cutoff of every text,
+                    None entries default to the current year
+            num_results: number of results per text
+            facet_filters: see 'top_scoring_for_topic_vectors'
+        Returns:
+            list with a list of (doc_id, score) tuples for every text
+        """
+        topic_vectors = self.texts_to_topic_vectors(texts)
+        return self.top_scoring_for_topic_vectors(topic_vectors,
+                                                  publication_years,
+                                                  num_results,
+                                                  **facet_filters)
+
+    def _load_array(self, name):
+        return np.load(os.path.join(self.path, name + '.npy'), mmap_mode='r')
+
+
+class BundleReferences(object):
+    """Mapping from document id to the array of its references, backed by
+    the memory-mapped compressed sparse row arrays of a bundle"""
+
+    def __init__(self, doc_ids, indptr, reference_ids):
+        self.doc_ids = doc_ids
+        self.indptr = indptr
+        self.reference_ids = reference_ids
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    def __contains__(self, doc_id):
+        row = np.searchsorted(self.doc_ids, doc_id)
+        return row < len(self.doc_ids) and self.doc_ids[row] == doc_id
+
+    def __getitem__(self, doc_id):
+        row = np.searchsorted(self.doc_ids, doc_id)
+        if row >= len(self.doc_ids) or self.doc_ids[row] != doc_id:
+            raise KeyError(doc_id)
+        return self.reference_ids[self.indptr[row]:self.indptr[row + 1]]
+
+    def keys(self):
+        return self.doc_ids.tolist()
+
+    def items(self):
+        return [(doc_id, self.reference_ids[start:end])
+                for doc_id, start, end in zip(self.doc_ids.tolist(),
+                                              self.indptr[:-1].tolist(),
+                                              self.indptr[1:].tolist())]
+
+
+def _save_array(path, name, array):
+    np.save(os.path.join(path, name + '.npy'), array)
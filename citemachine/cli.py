@@ -0,0 +1,349 @@
+"""Command line interface to the citemachine pipeline
+
+Every stage writes its artifact to a work directory and records the
+parameters it was run with, so running a stage again is skipped unless its
+parameters changed, an upstream stage was rerun since, or --force is given:
+
+    python -m citemachine parse DBLP.txt
+    python -m citemachine preprocess --min-word-count 5
+    python -m citemachine train --topics 100
+    python -m citemachine rank-communities
+    python -m citemachine query "some abstract text"
+    python -m citemachine evaluate --sample-size 5000
+    python -m citemachine serve --port 8000
+    python -m citemachine sweep --topics 50 100 --min-word-count 3 5
+
+Heavy dependencies (gensim, nltk, networkx) are only imported by the stages
+that need them, so 'query' and 'serve', which run from the memory-mapped
+model bundle written by 'train', start quickly.
+"""
+import argparse
+import cPickle
+import json
+import os
+import sys
+import time
+
+
+ARTIFACTS = {
+    'parse': 'corpus.pickle',
+    'preprocess': 'preprocessor.pickle',
+    'train': 'recommender.pickle',
+    'rank-communities': 'communityrank.pickle',
+    'sweep-data': 'sweep_data',
+}
+
+DEPENDENCIES = {
+    'parse': [],
+    'preprocess': ['parse'],
+    'train': ['preprocess'],
+    'rank-communities': ['parse'],
+    'sweep-data': ['parse'],
+}
+
+BUNDLE_DIR = 'bundle'
+STAGES_FILE = 'stages.json'
+
+
+class Workspace(object):
+    """Work directory holding the stage artifacts and a record of the
+    parameters and completion time of every stage"""
+
+    def __init__(self, path):
+        self.path = path
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+        stages_path = os.path.join(path, STAGES_FILE)
+        if os.path.exists(stages_path):
+            with open(stages_path) as stages_file:
+                self.stages = json.load(stages_file)
+        else:
+            self.stages = {}
+
+    def artifact(self, stage):
+        return os.path.join(self.path, ARTIFACTS[stage])
+
+    @property
+    def bundle_path(self):
+        return os.path.join(self.path, BUNDLE_DIR)
+
+    def is_complete(self, stage, params=None):
+        """True if the stage's artifact exists, it was made with the same
+        parameters, and every upstream stage is complete and was not rerun
+        since, checked recursively, so a rerun 'parse' also makes 'train'
+        stale"""
+        record = self.stages.get(stage)
+        if record is None or not os.path.exists(self.artifact(stage)):
+            return False
+        if params is not None and record['params'] != params:
+            return False
+
+        for dependency in DEPENDENCIES[stage]:
+            if not self.is_complete(dependency) or \
+                    self.stages[dependency]['completed'] > record['completed']:
+                return False
+        return True
+
+    def require(self, stage):
+        if not self.is_complete(stage):
+            raise SystemExit("No up to date '{stage}' artifact in {path}, "
+                             "run 'python -m citemachine {stage}' first"
+                             .format(stage=stage, path=self.path))
+
+    def load(self, stage):
+        self.require(stage)
+        with open(self.artifact(stage), 'rb') as artifact:
+            return cPickle.load(artifact)
+
+    def save(self, stage, obj, params):
+        # written to a temporary file first, so an interrupted stage never
+        # leaves a truncated artifact behind
+        temp_path = self.artifact(stage) + '.tmp'
+        with open(temp_path, 'wb') as artifact:
+            cPickle.dump(obj, artifact, protocol=cPickle.HIGHEST_PROTOCOL)
+        os.rename(temp_path, self.artifact(stage))
+        self.record(stage, params)
+
+    def record(self, stage, params):
+        self.stages[stage] = {'params': params, 'completed': time.time()}
+        with open(os.path.join(self.path, STAGES_FILE), 'w') as stages_file:
+            json.dump(self.stages, stages_file, indent=2, sort_keys=True)
+
+
+def _skip(workspace, stage, params, force):
+    if not force and workspace.is_complete(stage, params):
+        print "{stage}: up to date, skipping".format(stage=stage)
+        return True
+    return False
+
+
+def parse(args, workspace):
+    params = {'src': os.path.abspath(args.src), 'max_docs': args.max_docs,
+              'mtime': os.path.getmtime(args.src)}
+    if _skip(workspace, 'parse', params, args.force):
+        return
+
+    from citemachine.corpus.dblp import DBLP
+    corpus = DBLP(args.src, max_docs=args.max_docs)
+    workspace.save('parse', corpus, params)
+    print "parse: {n} documents".format(n=len(corpus.keys()))
+
+
+def preprocess(args, workspace):
+    params = {'min_word_count': args.min_word_count,
+              'max_word_count': args.max_word_count}
+    if _skip(workspace, 'preprocess', params, args.force):
+        return
+
+    from citemachine.text_process import CorpusPreprocessor
+    corpus = workspace.load('parse')
+    preprocessor = CorpusPreprocessor(corpus, **params)
+    workspace.save('preprocess', preprocessor, params)
+    print "preprocess: {n} words in the vocabulary".format(
+        n=len(preprocessor._valid_words))
+
+
+def train(args, workspace):
+    params = {'num_topics': args.topics}
+    if _skip(workspace, 'train', params, args.force):
+        return
+
+    from citemachine.recommender import LDARecommender
+    preprocessor = workspace.load('preprocess')
+    # the pickled preprocessor holds the corpus, loading the 'parse'
+    # artifact as well would keep a second copy in memory
+    recommender = LDARecommender(preprocessor._corpus, preprocessor,
+                                 num_topics=args.topics, train_at_init=True)
+    recommender.save_bundle(workspace.bundle_path)
+    workspace.save('train', recommender, params)
+    print "train: bundle written to {path}".format(path=workspace.bundle_path)
+
+
+def rank_communities(args, workspace):
+    params = {}
+    if _skip(workspace, 'rank-communities', params, args.force):
+        return
+
+    from citemachine.graph import CommunityRank, adj_lists_to_directed_graph
+    corpus = workspace.load('parse')
+    communityrank = CommunityRank(
+        adj_lists_to_directed_graph(corpus.references))
+    workspace.save('rank-communities', communityrank, params)
+    print "rank-communities: {n} communities".format(
+        n=len(communityrank.community_rankings))
+
+
+def query(args, workspace):
+    if args.communities:
+        from citemachine.recommender import CiteMachine
+        recommender = workspace.load('train')
+        citemachine = CiteMachine(recommender,
+                                  workspace.load('rank-communities'))
+        results = citemachine.get_recommended_docs_for_text(
+            args.text, venues=args.venues,
+            exclude_authors=args.exclude_authors)
+        results = results[:args.num_results]
+        titles = recommender.corpus.titles
+        title = lambda doc_id: titles[doc_id]
+    else:
+        from citemachine.bundle import load_bundle
+        if args.bundle is None:
+            workspace.require('train')
+        bundle = load_bundle(args.bundle or workspace.bundle_path)
+        results = bundle.top_scoring_for_text(
+            args.text, args.year, args.num_results, venues=args.venues,
+            exclude_authors=args.exclude_authors)
+        title = bundle.title
+
+    for doc_id, score in results:
+        doc_title = title(doc_id)
+        if isinstance(doc_title, unicode):
+            doc_title = doc_title.encode('utf-8')
+        print "{doc_id}\t{score:.4f}\t{title}".format(
+            doc_id=doc_id, score=score, title=doc_title)
+
+
+def evaluate(args, workspace):
+    from citemachine.evaluation import evaluate as run_evaluation
+    recommender = workspace.load('train')
+    report = run_evaluation(recommender, sample_size=args.sample_size,
+                            ks=args.ks, num_workers=args.workers,
+                            seed=args.seed, report_path=args.report)
+    print json.dumps(report, indent=2, sort_keys=True)
+
+
+def serve(args, workspace):
+    from citemachine.bundle import load_bundle
+    from citemachine.server import serve as run_server
+    if args.bundle is None:
+        workspace.require('train')
+    run_server(load_bundle(args.bundle or workspace.bundle_path),
+               args.host, args.port, max_batch_size=args.max_batch_size,
+               max_wait=args.max_wait, num_workers=args.workers)
+
+
+def sweep(args, workspace):
+    from citemachine import sweep as hyperparameter_sweep
+
+    data_path = workspace.artifact('sweep-data')
+    if not _skip(workspace, 'sweep-data', {}, args.force):
+        hyperparameter_sweep.prepare_sweep_data(workspace.load('parse'),
+                                                data_path)
+        workspace.record('sweep-data', {})
+
+    configurations = hyperparameter_sweep.sweep_configurations(
+        args.topics, args.min_word_count, args.max_word_count)
+    results = hyperparameter_sweep.run_sweep(
+        data_path, configurations,
+        sample_size=args.sample_size, ks=args.ks, num_workers=args.workers,
+        rank_by=args.rank_by,
+        report_path=args.report or os.path.join(workspace.path,
+                                                'sweep_report.json'))
+
+    print "topics\tmin\tmax\t{metric}\ttrain_s\tquery_ms\tpareto".format(
+        metric=args.rank_by)
+    for result in results:
+        configuration = result['configuration']
+        print "{topics}\t{min}\t{max}\t{quality:.4f}\t{train:.1f}\t" \
+              "{query:.2f}\t{pareto}".format(
+                  topics=configuration['num_topics'],
+                  min=configuration['min_word_count'],
+                  max=configuration['max_word_count'],
+                  quality=result['metrics'].get(args.rank_by, 0),
+                  train=result['train_seconds'],
+                  query=result['query_ms'] or 0,
+                  pareto='*' if result['pareto_optimal'] else '')
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog='citemachine', description='Citation recommendation pipeline')
+    parser.add_argument('--workdir', default='citemachine_work',
+                        help='directory of the stage artifacts')
+    parser.add_argument('--force', action='store_true',
+                        help='rerun the stage even if it is up to date')
+    parser.add_argument('--profile', action='store_true',
+                        help='log the time and memory used by every stage')
+    subparsers = parser.add_subparsers(dest='command')
+
+    sub = subparsers.add_parser('parse', help='parse a DBLP V6 file')
+    sub.add_argument('src')
+    sub.add_argument('--max-docs', type=int)
+    sub.set_defaults(func=parse)
+
+    sub = subparsers.add_parser('preprocess', help='tokenize and encode')
+    sub.add_argument('--min-word-count', type=int, default=5)
+    sub.add_argument('--max-word-count', type=int, default=500)
+    sub.set_defaults(func=preprocess)
+
+    sub = subparsers.add_parser('train', help='train the LDA recommender')
+    sub.add_argument('--topics', type=int, default=100)
+    sub.set_defaults(func=train)
+
+    sub = subparsers.add_parser('rank-communities',
+                                help='find and rank citation communities')
+    sub.set_defaults(func=rank_communities)
+
+    sub = subparsers.add_parser('query', help='recommend papers for a text')
+    sub.add_argument('text')
+    sub.add_argument('--year', type=int)
+    sub.add_argument('--num-results', type=int, default=10)
+    sub.add_argument('--bundle', help='bundle directory to query instead of '
+                                      'the one in the work directory')
+    sub.add_argument('--communities', action='store_true',
+                     help='rank through citation communities (CiteMachine)')
+    sub.add_argument('--venue', dest='venues', action='append',
+                     help='only recommend papers from this venue, repeatable')
+    sub.add_argument('--exclude-author', dest='exclude_authors',
+                     action='append',
+                     help='leave out papers by this author, repeatable')
+    sub.set_defaults(func=query)
+
+    sub = subparsers.add_parser('evaluate', help='evaluate the recommender')
+    sub.add_argument('--sample-size', type=int, default=1000)
+    sub.add_argument('--ks', type=int, nargs='+', default=[5, 10, 20])
+    sub.add_argument('--workers', type=int)
+    sub.add_argument('--seed', type=int, default=0)
+    sub.add_argument('--report', help='path of the JSON report')
+    sub.set_defaults(func=evaluate)
+
+    sub = subparsers.add_parser('serve', help='serve recommendations')
+    sub.add_argument('--bundle')
+    sub.add_argument('--host', default='127.0.0.1')
+    sub.add_argument('--port', type=int, default=8000)
+    sub.add_argument('--max-batch-size', type=int, default=32)
+    sub.add_argument('--max-wait', type=float, default=0.005)
+    sub.add_argument('--workers', type=int, default=2)
+    sub.set_defaults(func=serve)
+
+    sub = subparsers.add_parser('sweep',
+                                help='compare LDA hyperparameter settings')
+    sub.add_argument('--topics', type=int, nargs='+', default=[50, 100])
+    sub.add_argument('--min-word-count', type=int, nargs='+', default=[5])
+    sub.add_argument('--max-word-count', type=int, nargs='+', default=[500])
+    sub.add_argument('--sample-size', type=int, default=1000)
+    sub.add_argument('--ks', type=int, nargs='+', default=[10])
+    sub.add_argument('--rank-by', default='MAP',
+                     help='metric the settings are ranked by')
+    sub.add_argument('--workers', type=int)
+    sub.add_argument('--report', help='path of the JSON report')
+    sub.set_defaults(func=sweep)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+
+    if args.profile:
+        import logging
+        from citemachine import instrument
+        logging.basicConfig(level=logging.INFO)
+        instrument.set_sink(instrument.LoggingSink(), trace_memory=True)
+
+    args.func(args, Workspace(args.workdir))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
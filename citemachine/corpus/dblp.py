@@ -13,13 +13,22 @@
 # NOTE: Some fields might be missing!
 # DATA URL: http://arnetminer.org/citation
 
+from citemachine import instrument
+from citemachine.corpus.facets import FacetIndex
+
+
+def _parse_counts(result, dblp, *args, **kwargs):
+    return {'docs_parsed': len(dblp.titles),
+            'references': sum(len(refs) for refs in dblp.references.values())}
+
 
 class DBLP(object):
 
+    @instrument.instrumented('dblp.parse', counts=_parse_counts)
     def __init__(self, src, max_docs=None, only_with_refs_and_abstracts=True,
-                 remove_out_of_index_refs=True):
+                 remove_out_of_index_refs=True, build_facet_indexes=True):
         """By default only stores records which contain both an abstract and
-           a list of references"""
+           a list of references, and builds the author and venue indexes"""
         self.titles = {}
         self.authors = {}
         self.years = {}
@@ -119,6 +128,20 @@ class DBLP(object):
         if remove_out_of_index_refs:
             self.remove_out_of_index_references()
 
+        self._author_index = self._venue_index = None
+        if build_facet_indexes:
+            self.build_facet_indexes()
+
+    def __getstate__(self):
+        # the text getter is a nested class, which pickle can not find
+        state = self.__dict__.copy()
+        del state['texts']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.texts = self.TextGetter(self)
+
     class TextGetter(object):
         """Used to allow 'dblp.texts[doc_id]' without an extra dictionary"""
         def __init__(self, dblp):
@@ -151,6 +174,25 @@ class DBLP(object):
         """Returns ids of all documents in the index"""
         return self.titles.keys()
 
+    def build_facet_indexes(self):
+        """Builds the integer encoded author and venue inverted indexes"""
+        self._author_index = FacetIndex(self.authors)
+        self._venue_index = FacetIndex(self.conferences)
+
+    @property
+    def author_index(self):
+        """FacetIndex of the authors, rebuilt if documents were removed"""
+        if getattr(self, '_author_index', None) is None:
+            self.build_facet_indexes()
+        return self._author_index
+
+    @property
+    def venue_index(self):
+        """FacetIndex of the venues, rebuilt if documents were removed"""
+        if getattr(self, '_venue_index', None) is None:
+            self.build_facet_indexes()
+        return self._venue_index
+
     def pop(self, doc_id, default=0):
         """Remove doc_id from index"""
         self.titles.pop(doc_id, default)
@@ -160,6 +202,7 @@ class DBLP(object):
         self.citation_counts.pop(doc_id, default)
         self.references.pop(doc_id, default)
         self.abstracts.pop(doc_id, default)
+        self._author_index = self._venue_index = None
 
 
 def parse_to_doc_dict(src, max_docs=None):
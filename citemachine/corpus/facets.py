@@ -0,0 +1,213 @@
+"""Integer encoded inverted indexes over document metadata, such as authors
+and venues, used to filter and boost recommendations"""
+from __future__ import division
+
+import os
+
+import numpy as np
+
+
+ARRAYS = ['values', 'doc_ids', 'indptr', 'rows', 'doc_indptr', 'doc_values']
+
+
+class FacetIndex(object):
+    """Inverted index from facet values (e.g. author names) to documents
+
+    Values are stored as a sorted array of UTF-8 byte strings and encoded
+    as their position in it, so a value is found by binary search and a
+    saved index loads without building a dictionary of all values.
+    Documents are kept sorted by id, 'rows' holds the postings of every
+    value and 'doc_values' the values of every document, both in compressed
+    sparse row layout.
+    """
+
+    def __init__(self, doc_values=None, arrays=None):
+        """
+        Args:
+            doc_values: dict from document id to a value or list of values,
+                    None values and empty strings are skipped
+            arrays: used by 'load' to restore a saved index
+        """
+        if arrays is not None:
+            self.__dict__.update(arrays)
+        else:
+            self._build(doc_values)
+
+    def __len__(self):
+        return len(self.values)
+
+    def __contains__(self, value):
+        return self._find(value) is not None
+
+    def _build(self, doc_values):
+        doc_ids = np.array(sorted(doc_values.keys()), dtype=np.int64)
+
+        doc_indptr = [0]
+        encoded = []
+        for doc_id in doc_ids.tolist():
+            values = set(_encoded(value.strip())
+                         for value in _as_list(doc_values[doc_id]))
+            values.discard('')
+            # sorted values get increasing ids, so each document's value
+            # ids end up sorted as well
+            encoded.extend(sorted(values))
+            doc_indptr.append(len(encoded))
+
+        self.doc_ids = doc_ids
+        self.values = np.unique(np.array(encoded, dtype=np.string_))
+        self.doc_indptr = np.asarray(doc_indptr, dtype=np.int64)
+        self.doc_values = np.searchsorted(self.values,
+                                          encoded).astype(np.int64)
+
+        # invert the document -> values layout into value -> rows postings
+        doc_rows = np.repeat(np.arange(len(doc_ids)), np.diff(self.doc_indptr))
+        order = np.argsort(self.doc_values, kind='mergesort')
+        self.rows = doc_rows[order]
+        self.indptr = np.concatenate(
+            [[0], np.cumsum(np.bincount(self.doc_values,
+                                        minlength=len(self.values)))])
+
+    def _find(self, value):
+        """Id of the value, None if no document has it"""
+        value = _encoded(value)
+        value_id = int(np.searchsorted(self.values, value))
+        if value_id < len(self.values) and self.values[value_id] == value:
+            return value_id
+        return None
+
+    def value_id(self, value):
+        value_id = self._find(value)
+        if value_id is None:
+            raise KeyError(value)
+        return value_id
+
+    def value(self, value_id):
+        return self.values[value_id].decode('utf-8')
+
+    def rows_with(self, value):
+        """Rows of the documents that have the value"""
+        value_id = self._find(value)
+        if value_id is None:
+            return self.rows[:0]
+        return self.rows[self.indptr[value_id]:self.indptr[value_id + 1]]
+
+    def mask(self, values):
+        """Boolean array over the index's rows, True for documents with any
+        of the values
+
+        Raises:
+            TypeError: if values is a single string instead of a list
+        """
+        if isinstance(values, basestring):
+            raise TypeError('Expected a list of facet values, got the '
+                            'string {values!r}'.format(values=values))
+        mask = np.zeros(len(self.doc_ids), dtype=bool)
+        for value in values:
+            mask[self.rows_with(value)] = True
+        return mask
+
+    def values_of(self, doc_id):
+        """Values of a document"""
+        row = self.row_of(doc_id)
+        value_ids = self.doc_values[self.doc_indptr[row]:
+                                    self.doc_indptr[row + 1]]
+        return [self.value(value_id) for value_id in value_ids]
+
+    def row_of(self, doc_id):
+        row = np.searchsorted(self.doc_ids, doc_id)
+        if row >= len(self.doc_ids) or self.doc_ids[row] != doc_id:
+            raise KeyError(doc_id)
+        return int(row)
+
+    def rows_of(self, doc_ids):
+        """Rows of many documents, -1 for documents missing from the index"""
+        doc_ids = np.asarray(doc_ids, dtype=np.int64)
+        rows = np.searchsorted(self.doc_ids, doc_ids)
+        rows[rows >= len(self.doc_ids)] = 0
+        rows[self.doc_ids[rows] != doc_ids] = -1
+        return rows
+
+    def save(self, path):
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        for name in ARRAYS:
+            np.save(os.path.join(path, name + '.npy'), getattr(self, name))
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        arrays = {name: np.load(os.path.join(path, name + '.npy'),
+                                mmap_mode=mmap_mode)
+                  for name in ARRAYS}
+        return cls(arrays=arrays)
+
+
+class Facets(object):
+    """Author and venue filters aligned with the rows of a topic matrix
+
+    Masks and weights are computed from the postings of the requested
+    values, so they cost time proportional to the number of matching
+    documents plus one vectorized pass over the rows.
+    """
+
+    def __init__(self, author_index, venue_index, doc_ids):
+        """
+        Args:
+            author_index / venue_index: FacetIndex instances
+            doc_ids: document ids in the row order of the topic matrix
+        """
+        self.author_index = author_index
+        self.venue_index = venue_index
+        self._author_rows = author_index.rows_of(doc_ids)
+        self._venue_rows = venue_index.rows_of(doc_ids)
+
+    def mask(self, venues=None, exclude_authors=None):
+        """Boolean array over the rows, or None if nothing is filtered
+
+        Args:
+            venues: only documents published in one of these venues pass
+            exclude_authors: documents by any of these authors are removed,
+                    e.g. the query's authors to leave out self-citations
+        """
+        mask = None
+        if venues is not None:
+            mask = _aligned(self.venue_index.mask(venues), self._venue_rows)
+        if exclude_authors:
+            by_authors = _aligned(self.author_index.mask(exclude_authors),
+                                  self._author_rows)
+            mask = ~by_authors if mask is None else mask & ~by_authors
+        return mask
+
+    def weights(self, boost_venues=None, venue_boost=1.5):
+        """Score multipliers over the rows, or None if nothing is boosted
+
+        Args:
+            boost_venues: documents from these venues have their score
+                    multiplied by venue_boost
+        """
+        if not boost_venues:
+            return None
+        weights = np.ones(len(self._venue_rows), dtype=np.float32)
+        weights[_aligned(self.venue_index.mask(boost_venues),
+                         self._venue_rows)] = venue_boost
+        return weights
+
+
+def _aligned(mask, rows):
+    """Reorders a mask over an index's rows into another row order, rows of
+    documents missing from the index (-1) are False"""
+    return np.append(mask, False)[rows]
+
+
+def _encoded(value):
+    """Values are compared as UTF-8 byte strings"""
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+
+def _as_list(values):
+    if values is None:
+        return []
+    if isinstance(values, basestring):
+        return [values]
+    return values
@@ -0,0 +1,227 @@
+"""Seeded generator of synthetic corpora in the DBLP V6 format parsed by
+citemachine.corpus.dblp
+
+The generated corpus mimics the properties of the real data that matter for
+the pipeline's performance:
+  - a Zipfian vocabulary, with every topic favouring its own words
+  - documents that mix a few topics
+  - a year distribution that grows exponentially towards the present
+  - a citation graph where documents cite earlier ones, mostly of their own
+    topics, with preferential attachment to already well cited documents
+  - Zipfian author productivity and topic specific venues
+  - a fraction of documents without an abstract or references
+
+Usage: python -m citemachine.corpus.synthetic OUTPUT [--scale small]
+"""
+from __future__ import division
+
+import argparse
+
+import numpy as np
+
+
+SCALES = {
+    'tiny': 1000,
+    'small': 10000,
+    'medium': 100000,
+    'large': 1000000,
+}
+
+_CONSONANTS = 'bcdfghjklmnprstvz'
+_VOWELS = 'aeiou'
+
+
+def generate_dblp(path, num_docs=10000, num_topics=50, vocabulary_size=20000,
+                  num_authors=None, num_venues=None, mean_abstract_words=120,
+                  mean_references=8, first_year=1970, last_year=2013,
+                  missing_abstract_rate=0.2, seed=0):
+    """Writes a synthetic DBLP V6 file
+
+    Args:
+        path: file to write
+        num_docs: number of documents
+        num_topics: number of latent topics used to generate the texts
+        vocabulary_size: number of distinct words
+        num_authors / num_venues: sizes of the author and venue pools,
+                scale with num_docs by default
+        mean_abstract_words / mean_references: average abstract length and
+                number of references per document
+        first_year / last_year: range of publication years
+        missing_abstract_rate: fraction of documents without an abstract
+        seed: random seed, the same arguments always produce the same file
+    Returns:
+        number of citation links written
+    """
+    rs = np.random.RandomState(seed)
+    if num_authors is None:
+        num_authors = max(10, num_docs // 2)
+    if num_venues is None:
+        num_venues = max(num_topics, num_docs // 200)
+
+    vocabulary = _make_vocabulary(vocabulary_size, rs)
+    topic_cdfs = _make_topic_word_cdfs(num_topics, vocabulary_size, rs)
+
+    # documents are generated in publication order, so citations only point
+    # backwards in time
+    years = _sample_years(num_docs, first_year, last_year, rs)
+    doc_topics = [rs.choice(num_topics, size=rs.randint(1, 4), replace=False)
+                  for _ in range(num_docs)]
+
+    references = _make_citation_graph(doc_topics, num_topics,
+                                      mean_references, rs)
+    citation_counts = np.zeros(num_docs, dtype=np.int64)
+    for refs in references:
+        citation_counts[refs] += 1
+
+    author_cdf = _zipf_cdf(num_authors, 1.1)
+    venue_topics = rs.randint(0, num_topics, size=num_venues)
+    topic_venues = [np.flatnonzero(venue_topics == topic)
+                    for topic in range(num_topics)]
+
+    # ids are shuffled so that they do not reveal the publication order
+    doc_ids = rs.permutation(num_docs) + 1
+
+    num_links = 0
+    with open(path, 'w') as output:
+        output.write('{links}\n'.format(links=sum(map(len, references))))
+
+        for doc in range(num_docs):
+            topics = doc_topics[doc]
+            mixture = rs.dirichlet(np.ones(len(topics)))
+
+            title = _sample_text(rs.randint(4, 12), topics, mixture,
+                                 topic_cdfs, vocabulary, rs)
+            num_doc_authors = rs.randint(1, 6)
+            authors = np.searchsorted(author_cdf,
+                                      rs.random_sample(num_doc_authors))
+            venues = topic_venues[topics[0]]
+            venue = rs.choice(venues) if len(venues) else \
+                rs.randint(num_venues)
+
+            output.write('#*{title}\n'.format(title=title.capitalize()))
+            output.write('#@{authors}\n'.format(
+                authors=','.join('Author %d' % a for a in authors)))
+            output.write('#year{year}\n'.format(year=years[doc]))
+            output.write('#conf{venue}\n'.format(venue='Venue %d' % venue))
+            output.write('#citation{count}\n'.format(
+                count=citation_counts[doc]))
+            output.write('#index{id}\n'.format(id=doc_ids[doc]))
+            output.write('#arnetid{id}\n'.format(id=doc_ids[doc]))
+            for ref in references[doc]:
+                output.write('#%{ref}\n'.format(ref=doc_ids[ref]))
+                num_links += 1
+            if rs.random_sample() >= missing_abstract_rate:
+                num_words = max(10, int(rs.lognormal(
+                    np.log(mean_abstract_words), 0.4)))
+                abstract = _sample_text(num_words, topics, mixture,
+                                        topic_cdfs, vocabulary, rs)
+                output.write('#!{abstract}.\n'.format(
+                    abstract=abstract.capitalize()))
+            output.write('\n')
+
+    return num_links
+
+
+def _zipf_cdf(size, exponent):
+    weights = 1 / np.arange(1, size + 1) ** exponent
+    cdf = np.cumsum(weights)
+    return cdf / cdf[-1]
+
+
+def _make_vocabulary(size, rs):
+    """Pronounceable, distinct words of 2 to 5 syllables"""
+    words = set()
+    while len(words) < size:
+        syllables = rs.randint(2, 6)
+        words.add(''.join(rs.choice(list(_CONSONANTS)) +
+                          rs.choice(list(_VOWELS))
+                          for _ in range(syllables)))
+    return sorted(words)
+
+
+def _make_topic_word_cdfs(num_topics, vocabulary_size, rs):
+    """Every topic is a Zipf distribution over its own random ordering of
+    the vocabulary, mixed with a shared Zipfian background"""
+    zipf = 1 / np.arange(1, vocabulary_size + 1) ** 1.07
+    zipf /= zipf.sum()
+
+    cdfs = []
+    for _ in range(num_topics):
+        topic = np.empty(vocabulary_size)
+        topic[rs.permutation(vocabulary_size)] = zipf
+        cdf = np.cumsum(0.7 * topic + 0.3 * zipf)
+        cdfs.append(cdf / cdf[-1])
+    return cdfs
+
+
+def _sample_years(num_docs, first_year, last_year, rs):
+    """Sorted years, with publication volume growing ~7% per year"""
+    span = np.arange(first_year, last_year + 1)
+    weights = 1.07 ** (span - first_year)
+    return np.sort(rs.choice(span, size=num_docs, p=weights / weights.sum()))
+
+
+def _make_citation_graph(doc_topics, num_topics, mean_references, rs):
+    """Every document cites earlier documents, 80% of the time from one of
+    its own topics. Candidates are drawn from per topic urns holding every
+    document once plus once per citation it received, which gives
+    preferential attachment."""
+    topic_urns = [[] for _ in range(num_topics)]
+    all_urn = []
+
+    references = []
+    for doc, topics in enumerate(doc_topics):
+        refs = set()
+        num_refs = rs.poisson(mean_references) if doc else 0
+        for _ in range(num_refs * 2):
+            if len(refs) >= num_refs:
+                break
+            if rs.random_sample() < 0.8:
+                urn = topic_urns[topics[rs.randint(len(topics))]]
+            else:
+                urn = all_urn
+            if urn:
+                refs.add(urn[rs.randint(len(urn))])
+
+        refs = sorted(refs)
+        references.append(refs)
+        for ref in refs:
+            all_urn.append(ref)
+            for topic in doc_topics[ref]:
+                topic_urns[topic].append(ref)
+
+        all_urn.append(doc)
+        for topic in topics:
+            topic_urns[topic].append(doc)
+
+    return references
+
+
+def _sample_text(num_words, topics, mixture, topic_cdfs, vocabulary, rs):
+    counts = rs.multinomial(num_words, mixture)
+    word_ids = np.concatenate([
+        np.searchsorted(topic_cdfs[topic], rs.random_sample(count))
+        for topic, count in zip(topics, counts)])
+    rs.shuffle(word_ids)
+    return ' '.join(vocabulary[i] for i in word_ids)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generates a synthetic '
+                                                 'DBLP V6 corpus')
+    parser.add_argument('output')
+    parser.add_argument('--scale', choices=sorted(SCALES), default='small')
+    parser.add_argument('--docs', type=int,
+                        help='number of documents, overrides --scale')
+    parser.add_argument('--topics', type=int, default=50)
+    parser.add_argument('--vocabulary', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    generate_dblp(args.output, num_docs=args.docs or SCALES[args.scale],
+                  num_topics=args.topics, vocabulary_size=args.vocabulary,
+                  seed=args.seed)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,14 @@
 from __future__ import division
 
+import json
+import random
+import time
+from multiprocessing import Pool, cpu_count
+
+import numpy as np
+
+from citemachine import topic_model
+
 
 def precision(num_found, num_retrieved):
     return num_found / num_retrieved
@@ -15,3 +24,189 @@ def F1_score(num_found, total_relevant, num_retrieved):
 
     F1 = 2 * p * r / (p + r)
     return F1
+
+
+def relevance_vector(ranked_ids, references):
+    """Boolean array marking which of the ranked documents are references
+
+    Args:
+        ranked_ids: array of recommended document ids, in rank order
+        references: sorted numpy array of the relevant document ids
+    """
+    return np.in1d(np.asarray(ranked_ids), references, assume_unique=True)
+
+
+def precision_at_k(hits, k):
+    return hits[:k].sum() / k
+
+
+def recall_at_k(hits, num_relevant, k):
+    return hits[:k].sum() / num_relevant
+
+
+def F1_at_k(hits, num_relevant, k):
+    p = precision_at_k(hits, k)
+    r = recall_at_k(hits, num_relevant, k)
+    return 2 * p * r / (p + r) if p + r > 0 else 0.0
+
+
+def average_precision(hits, num_relevant):
+    """Average of the precisions at the ranks of the relevant documents,
+    relevant documents that were not retrieved count as zero"""
+    if not hits.any():
+        return 0.0
+    ranks = np.flatnonzero(hits) + 1
+    precisions = np.arange(1, len(ranks) + 1) / ranks
+    return precisions.sum() / min(num_relevant, len(hits))
+
+
+def reciprocal_rank(hits):
+    ranks = np.flatnonzero(hits)
+    return 1 / (ranks[0] + 1) if len(ranks) else 0.0
+
+
+def ndcg_at_k(hits, num_relevant, k):
+    """Normalized discounted cumulative gain with binary relevance"""
+    discounts = 1 / np.log2(np.arange(2, k + 2))
+    dcg = (hits[:k] * discounts[:len(hits[:k])]).sum()
+    ideal = discounts[:min(num_relevant, k)].sum()
+    return dcg / ideal
+
+
+def metric_names(ks):
+    """Names of the metrics 'score_ranking' computes for the cutoffs ks"""
+    names = ['MAP', 'MRR']
+    for k in ks:
+        names.extend(template % k for template in
+                     ('precision@%d', 'recall@%d', 'F1@%d', 'nDCG@%d'))
+    return names
+
+
+def score_ranking(ranked_ids, references, ks):
+    """Computes all ranking metrics of a single query
+
+    Returns:
+        dict from metric name, e.g. 'precision@10' or 'MAP', to its value
+    """
+    hits = relevance_vector(ranked_ids, references)
+    num_relevant = len(references)
+
+    metrics = {'MAP': average_precision(hits, num_relevant),
+               'MRR': reciprocal_rank(hits)}
+    for k in ks:
+        metrics['precision@%d' % k] = precision_at_k(hits, k)
+        metrics['recall@%d' % k] = recall_at_k(hits, num_relevant, k)
+        metrics['F1@%d' % k] = F1_at_k(hits, num_relevant, k)
+        metrics['nDCG@%d' % k] = ndcg_at_k(hits, num_relevant, k)
+    return metrics
+
+
+# state shared with the forked worker processes
+_evaluation_context = {}
+
+
+def evaluate(recommender, doc_ids=None, references=None, sample_size=1000,
+             ks=(5, 10, 20), memory_limit=2 ** 28, num_workers=None, seed=0,
+             report_path=None):
+    """Evaluates how well the recommender retrieves the references of
+    held-out corpus documents
+
+    Documents are sampled from those with references, their recommendations
+    are computed in batches across a process pool, and the document itself
+    is left out of its own recommendations.
+
+    Args:
+        recommender: LDARecommender or bundle.ModelBundle
+        doc_ids: documents to evaluate, sampled from the corpus if None
+        references: dict from document id to its references, defaults to
+                the references of the recommender's corpus, or those stored
+                in the bundle. Required for bundles written without them
+        sample_size: number of sampled documents, all if None
+        ks: cutoffs of the precision, recall, F1 and nDCG metrics
+        memory_limit: approximate number of bytes used per worker to score
+                a batch of documents, sets the batch size
+        num_workers: number of worker processes, defaults to the CPU count
+        seed: seed of the document sample
+        report_path: if given, the report is written there as JSON
+    Returns:
+        report: dict with the evaluation parameters, the mean of every
+                metric and the elapsed time
+    """
+    start = time.time()
+    if references is None:
+        corpus = getattr(recommender, 'corpus', None)
+        if corpus is not None:
+            references = corpus.references
+        else:
+            references = recommender.references
+
+    if doc_ids is None:
+        doc_ids = sorted(doc_id for doc_id, refs in references.items()
+                         if len(refs))
+        if sample_size is not None and sample_size < len(doc_ids):
+            doc_ids = random.Random(seed).sample(doc_ids, sample_size)
+    doc_ids = [doc_id for doc_id in doc_ids if len(references[doc_id])]
+
+    # built before forking, so the workers share the recommender's topic
+    # matrix and filter columns copy-on-write instead of each building its
+    # own
+    topic_matrix = recommender.topic_matrix
+    getattr(recommender, 'filter_columns', None)
+    if isinstance(topic_matrix, tuple):
+        topic_matrix = topic_matrix[2]
+
+    batch_size = int(max(1, memory_limit // (
+        topic_model.SCORE_BYTES_PER_CELL * len(topic_matrix))))
+    batches = [doc_ids[i:i + batch_size]
+               for i in range(0, len(doc_ids), batch_size)]
+    if num_workers is None:
+        num_workers = cpu_count()
+
+    _evaluation_context.update({'recommender': recommender,
+                                'references': references,
+                                'ks': tuple(ks)})
+    try:
+        if num_workers > 1 and len(batches) > 1:
+            pool = Pool(num_workers)
+            try:
+                batch_metrics = pool.map(_evaluate_batch, batches)
+            finally:
+                pool.terminate()
+        else:
+            batch_metrics = [_evaluate_batch(batch) for batch in batches]
+    finally:
+        _evaluation_context.clear()
+
+    per_doc = [metrics for batch in batch_metrics for metrics in batch]
+    names = sorted(per_doc[0].keys()) if per_doc else []
+    report = {'num_docs': len(per_doc),
+              'ks': list(ks),
+              'sample_size': sample_size,
+              'seed': seed,
+              'metrics': {name: float(np.mean([m[name] for m in per_doc]))
+                          for name in names},
+              'elapsed': time.time() - start}
+
+    if report_path is not None:
+        with open(report_path, 'w') as report_file:
+            json.dump(report, report_file, indent=2, sort_keys=True)
+
+    return report
+
+
+def _evaluate_batch(doc_ids):
+    context = _evaluation_context
+    recommender = context['recommender']
+    references = context['references']
+    ks = context['ks']
+
+    # one extra result, since a document is usually its own top match
+    num_results = max(ks) + 1
+    results = recommender.top_scoring_for_docs(doc_ids, num_results)
+
+    batch_metrics = []
+    for doc_id, doc_scores in zip(doc_ids, results):
+        ranked_ids = [doc for doc, score in doc_scores if doc != doc_id]
+        refs = np.unique(np.asarray(references[doc_id]))
+        batch_metrics.append(score_ranking(ranked_ids[:max(ks)], refs, ks))
+    return batch_metrics
@@ -1,12 +1,25 @@
+from __future__ import division
+
+import time
 from collections import defaultdict
 from operator import itemgetter
 
+import numpy as np
+import scipy.sparse as sp
 import networkx as nx
 import community
 
+from citemachine import instrument
+
+
+def _community_rank_counts(result, communityrank, *args, **kwargs):
+    return {'nodes': communityrank.directed_graph.number_of_nodes(),
+            'communities_ranked': len(communityrank.community_rankings)}
+
 
 class CommunityRank(object):
 
+    @instrument.instrumented('community_rank', counts=_community_rank_counts)
     def __init__(self, directed_graph):
         self.directed_graph = directed_graph
 
@@ -46,6 +59,7 @@ class CommunityRank(object):
 
         return community_graphs
 
+    @instrument.instrumented('community_rank.pagerank')
     def _pagerank_communities(self, community_graphs):
 
         pageranks = {}
@@ -53,7 +67,114 @@ class CommunityRank(object):
             pagerank = nx.pagerank(community_graphs[com], max_iter=200)
             pageranks[com] = sorted(pagerank.items(), key=itemgetter(1), reverse=True)
         return pageranks
-        
+
+    @property
+    def citation_graph(self):
+        """CSR view of the full citation graph, built on first use"""
+        if getattr(self, '_citation_graph', None) is None:
+            self._citation_graph = CitationGraph(self.directed_graph)
+        return self._citation_graph
+
+
+class CitationGraph(object):
+    """Compressed sparse row representation of a directed citation graph,
+    used for query time random walks
+
+    Attributes:
+        nodes: list of node ids, position in the list is the node's index
+        node_index: dict from node id to its index
+        transition: transposed, row normalized adjacency matrix (CSR), so a
+                    single walk step is one sparse matrix-vector product
+        dangling: boolean mask of nodes without outgoing edges
+    """
+
+    def __init__(self, directed_graph):
+        self.nodes = list(directed_graph.nodes())
+        self.node_index = {node: i for i, node in enumerate(self.nodes)}
+
+        adjacency = nx.to_scipy_sparse_matrix(directed_graph,
+                                              nodelist=self.nodes,
+                                              dtype=np.float64,
+                                              format='csr')
+        out_degrees = np.asarray(adjacency.sum(axis=1)).ravel()
+        self.dangling = out_degrees == 0
+
+        inverse_degrees = np.zeros(len(self.nodes))
+        inverse_degrees[~self.dangling] = 1 / out_degrees[~self.dangling]
+        self.transition = (sp.diags(inverse_degrees, 0) * adjacency).T.tocsr()
+
+    def __len__(self):
+        return len(self.nodes)
+
+    @instrument.timed('citation_graph.personalized_pagerank')
+    def personalized_pagerank(self, seeds, damping=0.85, max_iter=20,
+                              tol=1e-6, time_budget=None):
+        """Runs a bounded number of power iterations of PageRank with
+        restarts to the seed nodes
+
+        Args:
+            seeds: iterable of (node, weight) pairs, nodes that are not in
+                   the graph are ignored
+            damping: probability of following a citation instead of
+                     jumping back to a seed
+            max_iter: maximum number of power iterations
+            tol: stops once the L1 change between iterations is below tol
+            time_budget: seconds after which no further iterations are
+                    started, at least one iteration is always run
+        Returns:
+            ranks: numpy array of scores aligned with 'nodes'
+            stats: dict with the number of 'iterations', final 'residual',
+                   whether the walk 'converged', whether the
+                   'budget_exhausted' and the 'elapsed' time in seconds
+        """
+        start = time.time()
+
+        personalization = np.zeros(len(self.nodes))
+        node_index = self.node_index
+        for node, weight in seeds:
+            if node in node_index:
+                personalization[node_index[node]] += weight
+
+        stats = {'iterations': 0, 'residual': 0.0, 'converged': False,
+                 'budget_exhausted': False, 'elapsed': 0.0}
+
+        total = personalization.sum()
+        if total <= 0:
+            stats['elapsed'] = time.time() - start
+            return personalization, stats
+        personalization /= total
+
+        ranks = personalization
+        for iteration in range(1, max_iter + 1):
+            dangling_mass = ranks[self.dangling].sum()
+            next_ranks = damping * self.transition.dot(ranks)
+            next_ranks += (damping * dangling_mass + 1 - damping) * personalization
+
+            residual = np.abs(next_ranks - ranks).sum()
+            ranks = next_ranks
+
+            stats['iterations'] = iteration
+            stats['residual'] = residual
+            if residual < tol:
+                stats['converged'] = True
+                break
+            if time_budget is not None and time.time() - start >= time_budget:
+                stats['budget_exhausted'] = iteration < max_iter
+                break
+
+        stats['elapsed'] = time.time() - start
+        return ranks, stats
+
+    def top_ranked(self, ranks, num_results):
+        """Returns the num_results highest ranked (node, score) pairs"""
+        num_results = min(num_results, len(ranks))
+        if num_results <= 0:
+            return []
+
+        top = np.argpartition(-ranks, num_results - 1)[:num_results]
+        top = top[np.argsort(-ranks[top])]
+        return [(self.nodes[i], ranks[i]) for i in top if ranks[i] > 0]
+
 
 def adj_lists_to_directed_graph(adjacency_lists):
     """Turns a dict of lists of nodes to a directed graph"""
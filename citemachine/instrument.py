@@ -0,0 +1,248 @@
+"""Opt-in instrumentation of the pipeline stages and the query hot paths
+
+Nothing is recorded until a sink is installed:
+
+    from citemachine import instrument
+    registry = instrument.RegistrySink()
+    instrument.set_sink(registry, trace_memory=True)
+    ... build the pipeline, run queries ...
+    registry.summary()
+
+Stages record their wall time, CPU time, peak memory and item counts, such
+as the number of documents parsed. Query functions record their latency.
+Every measurement is passed to the sink as a dict record with a 'type' of
+either 'stage' or 'timing', so any object with an 'emit(record)' method can
+be used as a sink.
+"""
+from __future__ import division
+
+import json
+import logging
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+cpu_time = getattr(time, 'process_time', None) or time.clock
+
+_sink = None
+_stage_depth = threading.local()
+
+
+def set_sink(sink, trace_memory=False):
+    """Installs the sink that receives all records, None disables recording
+
+    Args:
+        sink: object with an 'emit(record)' method
+        trace_memory: if True and tracemalloc is available, stages record
+                the peak memory allocated by Python, otherwise the peak
+                resident set size of the process
+    """
+    global _sink
+    _sink = sink
+    if trace_memory and tracemalloc is not None and \
+            not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def get_sink():
+    return _sink
+
+
+def is_enabled():
+    return _sink is not None
+
+
+class Stage(object):
+    """Item counts of a running stage"""
+
+    def __init__(self, name):
+        self.name = name
+        self.counts = {}
+
+    def count(self, **counts):
+        """Adds to the stage's item counts, e.g. stage.count(docs=10)"""
+        for name, value in counts.items():
+            self.counts[name] = self.counts.get(name, 0) + value
+
+
+class _NullStage(object):
+
+    def count(self, **counts):
+        pass
+
+
+_NULL_STAGE = _NullStage()
+
+
+@contextmanager
+def stage(name):
+    """Context manager measuring a pipeline stage, yields a Stage whose
+    'count' method records item counts"""
+    sink = _sink
+    if sink is None:
+        yield _NULL_STAGE
+        return
+
+    depth = getattr(_stage_depth, 'value', 0)
+    if depth == 0 and _is_tracing() and hasattr(tracemalloc, 'reset_peak'):
+        tracemalloc.reset_peak()
+    _stage_depth.value = depth + 1
+
+    current = Stage(name)
+    start_wall, start_cpu = time.time(), cpu_time()
+    try:
+        yield current
+    finally:
+        _stage_depth.value = depth
+        sink.emit({'type': 'stage',
+                   'name': name,
+                   'depth': depth,
+                   'wall_time': time.time() - start_wall,
+                   'cpu_time': cpu_time() - start_cpu,
+                   'peak_memory': _peak_memory(),
+                   'memory_source': 'tracemalloc' if _is_tracing()
+                                    else 'max_rss',
+                   'counts': current.counts})
+
+
+def instrumented(name, counts=None):
+    """Decorator measuring every call of a function as a stage
+
+    Args:
+        name: stage name
+        counts: optional function called with the return value followed by
+                the call's arguments, returning a dict of item counts
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if _sink is None:
+                return func(*args, **kwargs)
+
+            with stage(name) as current:
+                result = func(*args, **kwargs)
+                if counts is not None:
+                    current.count(**counts(result, *args, **kwargs))
+            return result
+        return wrapper
+    return decorator
+
+
+def timed(name):
+    """Decorator recording the latency of every call, for query hot paths"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            sink = _sink
+            if sink is None:
+                return func(*args, **kwargs)
+
+            start = time.time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                sink.emit({'type': 'timing', 'name': name,
+                           'seconds': time.time() - start})
+        return wrapper
+    return decorator
+
+
+def _is_tracing():
+    return tracemalloc is not None and tracemalloc.is_tracing()
+
+
+def _peak_memory():
+    """Peak memory in bytes, from tracemalloc when it is tracing"""
+    if _is_tracing():
+        return tracemalloc.get_traced_memory()[1]
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on OS X and in kilobytes on Linux
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class LoggingSink(object):
+    """Logs stages at INFO and query timings at DEBUG level"""
+
+    def __init__(self, logger=None):
+        self.logger = logger or logging.getLogger('citemachine.instrument')
+
+    def emit(self, record):
+        if record['type'] == 'stage':
+            self.logger.info(
+                '%s%s: wall %.3fs, cpu %.3fs, peak %.1f MB, %s',
+                '  ' * record['depth'], record['name'], record['wall_time'],
+                record['cpu_time'], record['peak_memory'] / 2 ** 20,
+                record['counts'])
+        else:
+            self.logger.debug('%s: %.3f ms', record['name'],
+                              record['seconds'] * 1000)
+
+
+class JSONLinesSink(object):
+    """Appends every record as a line of JSON to a file"""
+
+    def __init__(self, path):
+        self._file = open(path, 'a')
+        self._lock = threading.Lock()
+
+    def emit(self, record):
+        line = json.dumps(dict(record, timestamp=time.time()))
+        with self._lock:
+            self._file.write(line + '\n')
+            self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class RegistrySink(object):
+    """Keeps the records in memory: every stage record, and running counts
+    of the query timings"""
+
+    def __init__(self):
+        self.stages = []
+        self.timings = {}
+        self._lock = threading.Lock()
+
+    def emit(self, record):
+        with self._lock:
+            if record['type'] == 'stage':
+                self.stages.append(record)
+                return
+
+            seconds = record['seconds']
+            timing = self.timings.get(record['name'])
+            if timing is None:
+                self.timings[record['name']] = {
+                    'count': 1, 'total': seconds, 'min': seconds,
+                    'max': seconds}
+            else:
+                timing['count'] += 1
+                timing['total'] += seconds
+                timing['min'] = min(timing['min'], seconds)
+                timing['max'] = max(timing['max'], seconds)
+
+    def summary(self):
+        """Returns the stage records and, for every timed function, its call
+        count and mean, min and max latency in seconds"""
+        with self._lock:
+            timings = {}
+            for name, timing in self.timings.items():
+                timings[name] = dict(timing,
+                                     mean=timing['total'] / timing['count'])
+            return {'stages': list(self.stages), 'timings': timings}
+
+    def clear(self):
+        with self._lock:
+            self.stages = []
+            self.timings = {}
@@ -0,0 +1,295 @@
+"""Offline computation of the top-K recommendations for every document
+
+The table is stored in a directory as memory-mapped .npy files, so that a
+recommender can look up the neighbours of any corpus document without
+scoring it against the whole corpus:
+
+    doc_ids.npy: (N,) ids of the documents, in row order
+    ids.npy:     (N, K) ids of the top scoring documents, -1 if there are
+                 fewer than K valid documents
+    scores.npy:  (N, K) scores of those documents
+    manifest.json: table parameters and the fingerprint of the model
+    completed_blocks: indices of the blocks already written, used to resume
+                 an interrupted build
+"""
+from __future__ import division
+
+import hashlib
+import json
+import os
+import shutil
+from multiprocessing import Pool, cpu_count
+
+import numpy as np
+
+from citemachine import topic_model
+
+
+MANIFEST_FILE = 'manifest.json'
+DOC_IDS_FILE = 'doc_ids.npy'
+IDS_FILE = 'ids.npy'
+SCORES_FILE = 'scores.npy'
+PROGRESS_FILE = 'completed_blocks'
+FINGERPRINT_CHUNK = 2 ** 16
+
+# state shared with the forked worker processes
+_block_context = {}
+
+
+class NeighbourTable(object):
+    """Read-only, memory-mapped table of precomputed top-K recommendations"""
+
+    def __init__(self, path):
+        with open(os.path.join(path, MANIFEST_FILE)) as manifest_file:
+            self.manifest = json.load(manifest_file)
+
+        self.path = path
+        self.k = self.manifest['k']
+        self.doc_ids = np.load(os.path.join(path, DOC_IDS_FILE),
+                               mmap_mode='r')
+        self.ids = np.load(os.path.join(path, IDS_FILE), mmap_mode='r')
+        self.scores = np.load(os.path.join(path, SCORES_FILE), mmap_mode='r')
+        self._doc_index = None
+
+    def __contains__(self, doc_id):
+        return doc_id in self.doc_index
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    @property
+    def doc_index(self):
+        """Dictionary from document id to its row in the table"""
+        if self._doc_index is None:
+            self._doc_index = {doc: row for row, doc
+                               in enumerate(self.doc_ids.tolist())}
+        return self._doc_index
+
+    @property
+    def is_complete(self):
+        return len(_read_completed_blocks(self.path)) == \
+            self.manifest['num_blocks']
+
+    def verify(self, fingerprint):
+        """Checks that the table is complete and was built from the model
+        with the given fingerprint, see 'fingerprint'
+
+        Raises:
+            ValueError: if the table is incomplete or stale
+        """
+        if not self.is_complete:
+            raise ValueError('Neighbour table at {path} is incomplete, '
+                             'resume it with build_neighbour_table'
+                             .format(path=self.path))
+        if self.manifest.get('fingerprint') != fingerprint:
+            raise ValueError('Neighbour table at {path} was built for a '
+                             'different model or corpus'
+                             .format(path=self.path))
+
+    def lookup(self, doc_id, num_results=None):
+        """Returns the stored (doc_id, score) recommendations of a document
+
+        Args:
+            doc_id: id of a document of the corpus the table was built for
+            num_results: number of results, at most the table's k
+        """
+        if num_results is None or num_results > self.k:
+            num_results = self.k
+
+        row = self.doc_index[doc_id]
+        ids = self.ids[row, :num_results].tolist()
+        scores = self.scores[row, :num_results].tolist()
+        return [(doc, score) for doc, score in zip(ids, scores) if doc != -1]
+
+
+def fingerprint(doc_ids, topic_matrix, years, citation_counts):
+    """SHA-1 digest of everything a neighbour table is computed from,
+    independent of the row order of the arrays
+
+    Args:
+        doc_ids: document ids in row order
+        topic_matrix: (N, num_topics) document topic vectors
+        years / citation_counts: filter columns aligned with the rows
+    """
+    doc_ids = np.asarray(doc_ids, dtype=np.int64)
+    order = np.argsort(doc_ids, kind='mergesort')
+
+    digest = hashlib.sha1()
+    digest.update(doc_ids[order].tobytes())
+    for array, dtype in ((topic_matrix, np.float32), (years, np.int64),
+                         (citation_counts, np.int64)):
+        # hashed in chunks, so the whole matrix is never copied at once
+        for start in range(0, len(order), FINGERPRINT_CHUNK):
+            rows = order[start:start + FINGERPRINT_CHUNK]
+            digest.update(np.ascontiguousarray(array[rows],
+                                               dtype=dtype).tobytes())
+    return digest.hexdigest()
+
+
+def build_neighbour_table(recommender, path, k=100, memory_limit=2 ** 28,
+                          num_workers=None, overwrite=False):
+    """Computes the top-k recommendations of every document of the
+    recommender's corpus, honoring the same year and citation count filters
+    as LDARecommender.top_scoring_for_doc
+
+    Documents are scored in blocks of rows sized to keep each worker's score
+    matrix below memory_limit bytes. Finished blocks are recorded, so calling
+    this again with the same path, parameters and model resumes an
+    interrupted build.
+
+    Args:
+        recommender: trained LDARecommender
+        path: directory the table is written to
+        k: number of recommendations stored per document
+        memory_limit: approximate number of bytes used per worker
+        num_workers: number of worker processes, defaults to the CPU count
+        overwrite: discard an existing table at path that was built with
+                different parameters or for a different model, instead of
+                raising a ValueError
+    Returns:
+        NeighbourTable
+    """
+    doc_ids, _, topic_matrix = recommender.topic_matrix
+    years, citation_counts = recommender.filter_columns
+    num_docs = len(doc_ids)
+    k = min(k, num_docs)
+
+    bytes_per_row = topic_model.SCORE_BYTES_PER_CELL * num_docs
+    block_size = int(max(1, min(num_docs, memory_limit // bytes_per_row)))
+    num_blocks = (num_docs + block_size - 1) // block_size
+
+    manifest = {'k': k, 'num_docs': num_docs, 'block_size': block_size,
+                'num_blocks': num_blocks,
+                'num_topics': recommender.num_topics,
+                'fingerprint': fingerprint(doc_ids, topic_matrix, years,
+                                           citation_counts)}
+    _prepare_table(path, manifest, doc_ids, overwrite)
+
+    _block_context.update({
+        'path': path,
+        'k': k,
+        'block_size': block_size,
+        'doc_ids': np.asarray(doc_ids, dtype=np.int64),
+        'topic_matrix': topic_matrix,
+        'years': years,
+        'is_cited': citation_counts > 0,
+    })
+
+    completed = _read_completed_blocks(path)
+    remaining = [block for block in range(num_blocks)
+                 if block not in completed]
+
+    if num_workers is None:
+        num_workers = cpu_count()
+
+    try:
+        with open(os.path.join(path, PROGRESS_FILE), 'a') as progress:
+            if num_workers > 1 and len(remaining) > 1:
+                pool = Pool(num_workers)
+                try:
+                    for block in pool.imap_unordered(_compute_block,
+                                                     remaining):
+                        _mark_completed(progress, block)
+                finally:
+                    pool.terminate()
+            else:
+                for block in remaining:
+                    _mark_completed(progress, _compute_block(block))
+    finally:
+        _block_context.clear()
+
+    return NeighbourTable(path)
+
+
+def _prepare_table(path, manifest, doc_ids, overwrite=False):
+    """Creates the table files, or checks that an existing partial table
+    was started with the same parameters and model"""
+    manifest_path = os.path.join(path, MANIFEST_FILE)
+
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as manifest_file:
+            existing = json.load(manifest_file)
+        if existing == manifest:
+            return
+        if not overwrite:
+            raise ValueError('Existing neighbour table at {path} was built '
+                             'with different parameters or for a different '
+                             'model'.format(path=path))
+        shutil.rmtree(path)
+
+    if not os.path.isdir(path):
+        os.makedirs(path)
+
+    num_docs, k = manifest['num_docs'], manifest['k']
+    np.save(os.path.join(path, DOC_IDS_FILE),
+            np.asarray(doc_ids, dtype=np.int64))
+    ids = np.lib.format.open_memmap(os.path.join(path, IDS_FILE), mode='w+',
+                                    dtype=np.int64, shape=(num_docs, k))
+    ids[:] = -1
+    del ids
+    scores = np.lib.format.open_memmap(os.path.join(path, SCORES_FILE),
+                                       mode='w+', dtype=np.float32,
+                                       shape=(num_docs, k))
+    del scores
+
+    open(os.path.join(path, PROGRESS_FILE), 'w').close()
+    # the manifest is written last, it marks the table files as usable
+    with open(manifest_path, 'w') as manifest_file:
+        json.dump(manifest, manifest_file)
+
+
+def _read_completed_blocks(path):
+    progress_path = os.path.join(path, PROGRESS_FILE)
+    if not os.path.exists(progress_path):
+        return set()
+
+    with open(progress_path) as progress:
+        return set(int(line) for line in progress if line.strip())
+
+
+def _mark_completed(progress, block):
+    progress.write('{block}\n'.format(block=block))
+    progress.flush()
+    os.fsync(progress.fileno())
+
+
+def _compute_block(block):
+    """Scores one block of documents against the corpus and writes their
+    top-k into the table"""
+    context = _block_context
+    k = context['k']
+    doc_ids = context['doc_ids']
+    topic_matrix = context['topic_matrix']
+    years = context['years']
+
+    start = block * context['block_size']
+    end = min(start + context['block_size'], len(doc_ids))
+
+    scores = topic_model.histogram_intersection_block(topic_matrix[start:end],
+                                                      topic_matrix)
+    cutoffs = topic_model.document_year_cutoffs(years[start:end])
+    is_invalid = years[np.newaxis, :] > cutoffs[:, np.newaxis]
+    is_invalid |= ~context['is_cited']
+    scores[is_invalid] = -np.inf
+    del is_invalid
+
+    # row by row, so ties at the kth score are broken by the lower index
+    # exactly like the queries that do not use the table
+    top = np.empty((end - start, k), dtype=np.intp)
+    for row, row_scores in enumerate(scores):
+        top[row] = topic_model.top_k_indices(row_scores, k)
+    top_scores = scores[np.arange(end - start)[:, np.newaxis], top]
+
+    top_ids = doc_ids[top]
+    top_ids[np.isneginf(top_scores)] = -1
+    top_scores[np.isneginf(top_scores)] = 0
+
+    path = context['path']
+    ids_table = np.load(os.path.join(path, IDS_FILE), mmap_mode='r+')
+    scores_table = np.load(os.path.join(path, SCORES_FILE), mmap_mode='r+')
+    ids_table[start:end] = top_ids
+    scores_table[start:end] = top_scores
+    ids_table.flush()
+    scores_table.flush()
+
+    return block
@@ -1,18 +1,33 @@
+import time
 from datetime import date
-from collections import defaultdict
-from operator import itemgetter
 import cPickle
 
-from gensim.models.ldamodel import LdaModel
+import numpy as np
+import scipy.sparse as sp
 
+from citemachine import instrument
+from citemachine import neighbours
 from citemachine import topic_model
+from citemachine.bundle import save_bundle
+from citemachine.corpus.facets import Facets
+from citemachine.neighbours import NeighbourTable, build_neighbour_table
 from citemachine.text_process import CorpusPreprocessor
+from citemachine.util import LRUCache
+
+
+def _train_counts(result, recommender, *args, **kwargs):
+    return {'docs': len(recommender.preprocessor.number_encodings),
+            'topics': recommender.num_topics}
+
+
+def _citemachine_counts(result, citemachine, *args, **kwargs):
+    return {'communities': len(citemachine.community_topics)}
 
 
 class LDARecommender(object):
 
     def __init__(self, corpus, corpus_preprocessor=None, num_topics=100,
-                 train_at_init=False):
+                 train_at_init=False, query_cache_size=1024):
         """
         Args:
             corpus: an instance of a citation corpus class
@@ -20,7 +35,16 @@ class LDARecommender(object):
             num_topics: number of topics to train the LDA with
             train_at_init: if True, trains a new LDA model at initialization,
                     otherwise need to call '_train' method to train the model
+            query_cache_size: number of query texts whose topic vectors are
+                    kept, so repeated queries skip preprocessing and inference
         """
+        self.query_cache_size = query_cache_size
+        self._query_cache = LRUCache(query_cache_size)
+        self._topic_matrix = None
+        self._filter_columns = None
+        self._facets = None
+        self.neighbour_table = None
+
         self.corpus = corpus
         if corpus_preprocessor:
             self.preprocessor = corpus_preprocessor
@@ -35,6 +59,16 @@ class LDARecommender(object):
             self.LDA = None
             self.topics = None
 
+    def __getstate__(self):
+        """Leaves derived arrays and the memory-mapped neighbour table out of
+        pickles, they are rebuilt or reloaded when needed"""
+        state = self.__dict__.copy()
+        state['_topic_matrix'] = None
+        state['_filter_columns'] = None
+        state['_facets'] = None
+        state['neighbour_table'] = None
+        return state
+
     @classmethod
     def init_from_pickle(cls, pickle_path):
         """Used to instantiante new class by loading a pretrained model from
@@ -51,7 +85,15 @@ class LDARecommender(object):
 
         return self
 
+    def save_bundle(self, path):
+        """Writes the trained model to a memory-mappable bundle directory,
+        which can be served with 'bundle.load_bundle'"""
+        save_bundle(self, path)
+
+    @instrument.instrumented('lda.train', counts=_train_counts)
     def _train(self, num_topics=None):
+        from gensim.models.ldamodel import LdaModel
+
         if num_topics:
             self.num_topics = num_topics
 
@@ -61,10 +103,73 @@ class LDARecommender(object):
 
         self.topics = topic_model.build_topics_dict(self.LDA,
                             self.preprocessor.number_encodings)
-
+        self._topic_matrix = None
+        self._filter_columns = None
+        self.neighbour_table = None
+        self.query_cache.clear()
+
+    @property
+    def query_cache(self):
+        """LRU cache from query text to its topic vector"""
+        if getattr(self, '_query_cache', None) is None:
+            self._query_cache = LRUCache(getattr(self, 'query_cache_size',
+                                                 1024))
+        return self._query_cache
+
+    @property
+    def topic_matrix(self):
+        """Dense (num_docs, num_topics) matrix of the document topic vectors,
+        returned as (doc_ids, doc_index, matrix) and built on first use
+
+        Rows are sorted by document id, like the rows of a bundle, so ties
+        between equal scores go to the lower document id everywhere"""
+        if getattr(self, '_topic_matrix', None) is None:
+            doc_ids, matrix = topic_model.topics_dict_to_matrix(
+                self.topics, self.num_topics, sorted(self.topics))
+            doc_index = {doc: i for i, doc in enumerate(doc_ids)}
+            self._topic_matrix = (doc_ids, doc_index, matrix)
+            self._filter_columns = None
+            self._facets = None
+        return self._topic_matrix
+
+    @property
+    def facets(self):
+        """Author and venue filters aligned with the rows of 'topic_matrix',
+        built from the corpus' author_index and venue_index"""
+        if getattr(self, '_facets', None) is None:
+            if not hasattr(self.corpus, 'venue_index'):
+                raise ValueError('The corpus has no author and venue indexes')
+            doc_ids = self.topic_matrix[0]
+            self._facets = Facets(self.corpus.author_index,
+                                  self.corpus.venue_index, doc_ids)
+        return self._facets
+
+    @property
+    def filter_columns(self):
+        """Years and citation counts of the documents as numpy arrays aligned
+        with the rows of 'topic_matrix', returned as (years, citation_counts)
+        """
+        if getattr(self, '_filter_columns', None) is None:
+            doc_ids = self.topic_matrix[0]
+            years = self.corpus.years
+            citation_counts = self.corpus.citation_counts
+            self._filter_columns = (
+                np.array([years[doc] or 0 for doc in doc_ids]),
+                np.array([citation_counts[doc] for doc in doc_ids]))
+        return self._filter_columns
+
+    @instrument.timed('recommender.top_scoring_for_topics')
     def top_scoring_for_topics(self, topic_vector,
                                publication_year=None,
-                               num_results=None):
+                               num_results=None, **facet_filters):
+        """Keyword arguments are author and venue filters, see
+        'top_scoring_for_topic_vectors'"""
+
+        if facet_filters:
+            return self.top_scoring_for_topic_vectors([topic_vector],
+                                                      [publication_year],
+                                                      num_results,
+                                                      **facet_filters)[0]
 
         if publication_year is None:
             publication_year = date.today().year
@@ -79,100 +184,390 @@ class LDARecommender(object):
         else:
             return valid_scores[0:num_results]
 
-    def top_scoring_for_doc(self, doc_id, num_results=None):
+    def build_neighbour_table(self, path, k=100, **kwargs):
+        """Precomputes the top k recommendations of every document into a
+        memory-mapped table at path and uses it for 'top_scoring_for_doc'
+
+        Keyword arguments are passed on to neighbours.build_neighbour_table
+        """
+        self.neighbour_table = build_neighbour_table(self, path, k, **kwargs)
+        return self.neighbour_table
+
+    def load_neighbour_table(self, path):
+        """Uses a previously built neighbour table for 'top_scoring_for_doc',
+        raises a ValueError if the table is incomplete or was built for a
+        different model"""
+        doc_ids, _, topic_matrix = self.topic_matrix
+        years, citation_counts = self.filter_columns
+
+        table = NeighbourTable(path)
+        table.verify(neighbours.fingerprint(doc_ids, topic_matrix, years,
+                                            citation_counts))
+        self.neighbour_table = table
+        return table
+
+    def top_scoring_for_doc(self, doc_id, num_results=None, **facet_filters):
+
+        table = getattr(self, 'neighbour_table', None)
+        if table is not None and not facet_filters and \
+                num_results is not None and num_results <= table.k and \
+                doc_id in table:
+            return table.lookup(doc_id, num_results)
 
         topic_vector = self.topics[doc_id]
         publication_year = self.corpus.years[doc_id]
         return self.top_scoring_for_topics(topic_vector,
                                            publication_year,
-                                           num_results)
+                                           num_results,
+                                           **facet_filters)
+
+    def top_scoring_for_docs(self, doc_ids, num_results=10):
+        """Batched version of 'top_scoring_for_doc', uses the neighbour
+        table if one is loaded and holds enough results"""
+        table = getattr(self, 'neighbour_table', None)
+        if table is not None and num_results <= table.k and \
+                all(doc_id in table for doc_id in doc_ids):
+            return [table.lookup(doc_id, num_results) for doc_id in doc_ids]
+
+        all_doc_ids, doc_index, topic_matrix = self.topic_matrix
+        years, citation_counts = self.filter_columns
+        rows = [doc_index[doc_id] for doc_id in doc_ids]
+        cutoffs = topic_model.document_year_cutoffs(years[rows])
+        return topic_model.top_scoring_batch(topic_matrix[rows], topic_matrix,
+                                             all_doc_ids, years,
+                                             citation_counts, cutoffs,
+                                             num_results)
 
     def top_scoring_for_text(self, text, publication_year=None,
-                             num_results=None):
+                             num_results=None, **facet_filters):
 
         topic_vector = self.text_to_topic_vector(text)
         return self.top_scoring_for_topics(topic_vector,
                                            publication_year,
-                                           num_results)
+                                           num_results,
+                                           **facet_filters)
+
+    def top_scoring_for_texts(self, texts, publication_years=None,
+                              num_results=10, **facet_filters):
+        """Batched version of 'top_scoring_for_text'
 
+        Args:
+            texts: list of query texts
+            publication_years: list with the year cutoff of every text,
+                    None entries default to the current year
+            num_results: number of results per text
+            facet_filters: see 'top_scoring_for_topic_vectors'
+        Returns:
+            list with a list of (doc_id, score) tuples for every text
+        """
+        topic_vectors = self.texts_to_topic_vectors(texts)
+        return self.top_scoring_for_topic_vectors(topic_vectors,
+                                                  publication_years,
+                                                  num_results,
+                                                  **facet_filters)
+
+    def top_scoring_for_topic_vectors(self, topic_vectors,
+                                      publication_years=None,
+                                      num_results=10, venues=None,
+                                      exclude_authors=None,
+                                      boost_venues=None, venue_boost=1.5):
+        """Scores a batch of topic vectors against the corpus in one pass,
+        see 'top_scoring_for_texts'
+
+        The author and venue filters apply to every query of the batch:
+            venues: only recommend documents from these venues
+            exclude_authors: leave out documents by these authors, e.g. the
+                    query's own authors to avoid self-citations
+            boost_venues: multiply the scores of documents from these venues
+                    by venue_boost
+        """
+        doc_ids, _, topic_matrix = self.topic_matrix
+        years, citation_counts = self.filter_columns
+
+        row_mask = row_weights = None
+        if venues is not None or exclude_authors or boost_venues:
+            row_mask = self.facets.mask(venues, exclude_authors)
+            row_weights = self.facets.weights(boost_venues, venue_boost)
+
+        query_matrix = np.vstack([topic_model.topics_to_dense(topic_vector,
+                                                              self.num_topics)
+                                  for topic_vector in topic_vectors])
+        return topic_model.top_scoring_batch(
+            query_matrix, topic_matrix, doc_ids, years, citation_counts,
+            topic_model.year_cutoffs(publication_years, len(topic_vectors)),
+            num_results, row_mask=row_mask, row_weights=row_weights)
+
+    @instrument.timed('recommender.text_to_topic_vector')
     def text_to_topic_vector(self, text):
-        num_encoded_text = self.preprocessor.text_to_number_encoding(text)
-        topic_vector = self.LDA[num_encoded_text]
+        topic_vector = self.query_cache.get(text)
+        if topic_vector is None:
+            num_encoded_text = self.text_to_number_encoding(text)
+            topic_vector = self.LDA[num_encoded_text]
+            self.query_cache.put(text, topic_vector)
         return topic_vector
 
+    def texts_to_topic_vectors(self, texts, record=None):
+        """Batched version of 'text_to_topic_vector', texts that are not
+        cached are inferred together
 
-class CiteMachine(object):
-
-    def __init__(self, recommender, communityrank):
-        self.recommender = recommender
-        self.communityrank = communityrank
-        self.community_topics = self._get_community_topics()
-
-    def _get_community_topics(self):
-        community_graphs = self.communityrank.community_graphs
-        num_encodings = self.recommender.preprocessor.number_encodings
-        LDA = self.recommender.LDA
-
-        community_topics = {}
-        for com_id in community_graphs:
-
-            community_word_counts = defaultdict(int)
-            for doc in community_graphs[com_id].nodes():
-                for word_id, count in num_encodings[doc]:
-
-                    community_word_counts[word_id] += count
-
-            community_topics[com_id] = LDA[community_word_counts.items()]
-
-        return community_topics
+        Args:
+            texts: list of query texts
+            record: optional callable, called with the stage name and
+                    seconds spent on the 'encode' and 'infer' stages
+        """
+        cache = self.query_cache
+        start = time.time()
+        topic_vectors = [cache.get(text) for text in texts]
+        missing = [i for i, topic_vector in enumerate(topic_vectors)
+                   if topic_vector is None]
 
-    def get_recommended_docs_for_text(self, text, num_communities=5):
+        bows = [self.text_to_number_encoding(texts[i]) for i in missing]
+        encoded = time.time()
+        for i, topic_vector in zip(missing, self.infer_topic_vectors(bows)):
+            topic_vectors[i] = topic_vector
+            cache.put(texts[i], topic_vector)
 
-        query_topics = self.recommender.text_to_topic_vector(text)
-        ranked_communities = self.rank_communities_by_topics(query_topics)
+        if record is not None:
+            record('encode', encoded - start)
+            record('infer', time.time() - encoded)
+        return topic_vectors
 
-        docs = []
-        for com, score in ranked_communities[:num_communities]:
-            for doc, score in self.communityrank.community_rankings[com][:10]:
-                docs.append(doc)
+    def text_to_number_encoding(self, text):
+        return self.preprocessor.text_to_number_encoding(text)
 
-        return self._renrank_on_topics(query_topics, docs)
+    def infer_topic_vectors(self, bows):
+        """Infers the topic vectors of a list of number encoded texts"""
+        return topic_model.batch_infer_topics(self.LDA, bows)
 
-    def rank_communities_by_topics(self, topics):
-        similarity_scores = []
-        for com, com_topics in self.community_topics.items():
-            score = topic_model.histogram_intersection_kernel(topics, com_topics)
-            similarity_scores.append((com, score))
-        return  sorted(similarity_scores, key=itemgetter(1), reverse=True)
 
-    def _renrank_on_topics(self, query_topics, docs):
-        recommender = self.recommender
-        results = []
-        for doc in docs:
-            score = topic_model.histogram_intersection_kernel(query_topics, recommender.topics[doc])
-            results.append((doc, score))
+class CiteMachine(object):
 
-        return sorted(results, key=itemgetter(1), reverse=True)
+    @instrument.instrumented('citemachine', counts=_citemachine_counts)
+    def __init__(self, recommender, communityrank):
+        self.recommender = recommender
+        self.communityrank = communityrank
 
+        _, self._doc_index, self._doc_term_matrix = \
+            recommender.preprocessor.term_matrix
 
+        self.community_topics = self._get_community_topics()
+        self._build_community_topic_matrix()
 
+        # built now rather than inside the first personalized query, where
+        # it would blow that query's latency budget
+        self.communityrank.citation_graph
 
+    def _build_community_topic_matrix(self):
+        """Stacks the community topic vectors into a dense matrix, so that
+        communities can be scored in a single vectorized pass"""
+        self._community_ids, self._community_topic_matrix = \
+            topic_model.topics_dict_to_matrix(self.community_topics,
+                                              self.recommender.num_topics)
 
+    def _get_community_topics(self, community_ids=None):
+        """Computes the topic vectors of the communities from the summed word
+        counts of their documents
 
+        The word counts of all communities are computed as one sparse product
+        of the community membership matrix and the document-term matrix, and
+        the LDA inference runs on all communities in a single batch.
 
+        Args:
+            community_ids: communities to compute topics for, defaults to all
+        Returns:
+            dict from community id to topic vector
+        """
+        if community_ids is None:
+            community_ids = list(self.communityrank.community_graphs.keys())
+        if not community_ids:
+            return {}
+
+        membership = self._community_membership_matrix(community_ids)
+        community_word_counts = (membership * self._doc_term_matrix).tocsr()
+
+        bows = topic_model.sparse_rows_to_bows(community_word_counts)
+        topic_vectors = topic_model.batch_infer_topics(self.recommender.LDA,
+                                                       bows)
+        return dict(zip(community_ids, topic_vectors))
+
+    def _community_membership_matrix(self, community_ids):
+        """Sparse matrix with a 1 at (i, j) if document j is a member of
+        community_ids[i]"""
+        community_graphs = self.communityrank.community_graphs
+        doc_index = self._doc_index
 
+        indptr = [0]
+        indices = []
+        for com_id in community_ids:
+            indices.extend(doc_index[doc]
+                           for doc in community_graphs[com_id].nodes()
+                           if doc in doc_index)
+            indptr.append(len(indices))
 
+        return sp.csr_matrix((np.ones(len(indices)), indices, indptr),
+                             shape=(len(community_ids), len(doc_index)))
 
+    def update_community_topics(self, community_ids):
+        """Recomputes the topic vectors of communities whose membership has
+        changed in the community rank, and drops those of removed communities
 
+        Args:
+            community_ids: ids of the changed, added or removed communities
+        """
+        community_graphs = self.communityrank.community_graphs
 
+        changed = []
+        for com_id in community_ids:
+            if com_id in community_graphs:
+                changed.append(com_id)
+            else:
+                self.community_topics.pop(com_id, None)
 
+        self.community_topics.update(self._get_community_topics(changed))
+        self._build_community_topic_matrix()
 
+    @instrument.timed('citemachine.get_recommended_docs_for_text')
+    def get_recommended_docs_for_text(self, text, num_communities=5,
+                                      venues=None, exclude_authors=None,
+                                      venue_boost=None, num_boost_venues=5):
+        """Recommends the top ranked documents of the communities closest in
+        topic to the text, reranked on their topic similarity
 
+        Args:
+            text: query text
+            num_communities: number of communities to recommend from
+            venues: only recommend documents from these venues
+            exclude_authors: leave out documents by these authors
+            venue_boost: if given, scores of documents from the
+                    num_boost_venues venues most common in the matched
+                    communities are multiplied by it
+        """
+        query_topics = self.recommender.text_to_topic_vector(text)
+        ranked_communities = self.rank_communities_by_topics(query_topics,
+                                                             num_communities)
 
+        docs = []
+        for com, score in ranked_communities:
+            for doc, score in self.communityrank.community_rankings[com][:10]:
+                docs.append(doc)
 
+        boost_venues = None
+        if venue_boost is not None:
+            boost_venues = self.community_venues(ranked_communities,
+                                                 num_boost_venues)
 
+        return self._renrank_on_topics(query_topics, docs, venues,
+                                       exclude_authors, boost_venues,
+                                       venue_boost)
 
+    def community_venues(self, ranked_communities, num_venues=5):
+        """Returns the venues most common among the documents of the ranked
+        communities, with each community weighted by its score
 
+        Args:
+            ranked_communities: list of (community_id, score) tuples
+            num_venues: number of venues to return
+        """
+        venue_index = self.recommender.corpus.venue_index
+        community_graphs = self.communityrank.community_graphs
 
+        venue_weights = np.zeros(len(venue_index))
+        for com, score in ranked_communities:
+            rows = venue_index.rows_of(community_graphs[com].nodes())
+            rows = rows[rows >= 0]
+            starts = venue_index.doc_indptr[rows]
+            has_venue = venue_index.doc_indptr[rows + 1] > starts
+            venue_ids = venue_index.doc_values[starts[has_venue]]
+            venue_weights += score * np.bincount(venue_ids,
+                                                 minlength=len(venue_index))
+
+        top = topic_model.top_k_indices(venue_weights, num_venues)
+        return [venue_index.value(i) for i in top if venue_weights[i] > 0]
+
+    @instrument.timed('citemachine.get_personalized_docs_for_text')
+    def get_personalized_docs_for_text(self, text, num_results=10,
+                                       num_seeds=20, damping=0.85,
+                                       max_iter=20, time_budget=0.1):
+        """Recommends documents by running a personalized PageRank over the
+        citation graph, seeded with the documents most similar in topic to
+        the text
 
+        Args:
+            text: query text
+            num_results: number of documents to return
+            num_seeds: number of topic similar documents used as restart
+                    nodes, weighted by their similarity to the query
+            damping / max_iter: passed on to the PageRank iterations
+            time_budget: latency budget in seconds for the whole query,
+                    iterations stop once it is used up
+        Returns:
+            results: list of (doc_id, score) tuples, sorted by score
+            stats: iteration stats of the walk, with the additional
+                   'seed_time' spent on finding the seed documents and the
+                   'graph_time' spent on building the citation graph, zero
+                   once it is built
+        """
+        start = time.time()
 
+        query_topics = self.recommender.text_to_topic_vector(text)
+        seeds = self.recommender.top_scoring_for_topic_vectors(
+            [query_topics], num_results=num_seeds)[0]
+        seed_time = time.time() - start
+
+        # a graph that still has to be built, e.g. after unpickling the
+        # CommunityRank, is charged to the budget as well
+        citation_graph = self.communityrank.citation_graph
+        graph_time = time.time() - start - seed_time
+
+        walk_budget = None
+        if time_budget is not None:
+            walk_budget = max(time_budget - seed_time - graph_time, 0)
+
+        ranks, stats = citation_graph.personalized_pagerank(
+            seeds, damping=damping, max_iter=max_iter,
+            time_budget=walk_budget)
+        stats['seed_time'] = seed_time
+        stats['graph_time'] = graph_time
+
+        return citation_graph.top_ranked(ranks, num_results), stats
+
+    @instrument.timed('citemachine.rank_communities_by_topics')
+    def rank_communities_by_topics(self, topics, num_communities=None):
+        """Ranks the communities by the similarity of their topics to the
+        query topics, only the top num_communities are sorted and returned
+        if given"""
+        query = topic_model.topics_to_dense(topics, self.recommender.num_topics)
+        scores = topic_model.histogram_intersection_scores(
+            query, self._community_topic_matrix)
+
+        if num_communities is None:
+            num_communities = len(scores)
+        top = topic_model.top_k_indices(scores, num_communities)
+
+        community_ids = self._community_ids
+        return [(community_ids[i], float(scores[i])) for i in top]
+
+    def _renrank_on_topics(self, query_topics, docs, venues=None,
+                           exclude_authors=None, boost_venues=None,
+                           venue_boost=None):
+        recommender = self.recommender
+        _, doc_index, topic_matrix = recommender.topic_matrix
+
+        query = topic_model.topics_to_dense(query_topics,
+                                            recommender.num_topics)
+        rows = [doc_index[doc] for doc in docs]
+        scores = topic_model.histogram_intersection_scores(query,
+                                                           topic_matrix[rows])
+
+        is_valid = np.ones(len(docs), dtype=bool)
+        if venues is not None or exclude_authors or boost_venues:
+            facets = recommender.facets
+            mask = facets.mask(venues, exclude_authors)
+            if mask is not None:
+                is_valid = mask[rows]
+            weights = facets.weights(boost_venues, venue_boost)
+            if weights is not None:
+                scores *= weights[rows]
+
+        order = np.argsort(-scores, kind='mergesort')
+        return [(docs[i], float(scores[i])) for i in order if is_valid[i]]
@@ -0,0 +1,445 @@
+"""HTTP/JSON recommendation service with request micro-batching
+
+Concurrent queries are gathered into micro-batches, bounded by a maximum
+batch size and a maximum wait, and each batch is encoded, inferred and
+scored together in a worker pool. Works with any recommender providing the
+batched query methods of LDARecommender, usually a bundle.ModelBundle.
+
+Endpoints:
+    POST /recommend  {"text": ..., "year": optional, "num_results": optional,
+                      "venues": optional, "exclude_authors": optional,
+                      "boost_venues": optional}
+                     -> {"results": [[doc_id, score], ...]}
+    GET  /stats      -> queue depth, batch sizes and per-stage latencies
+    GET  /health     -> {"status": "ok"}
+
+Run with 'python -m citemachine.server serve BUNDLE_DIR', and measure with
+'python -m citemachine.server load-test URL QUERIES_FILE'.
+"""
+from __future__ import division
+
+import argparse
+import json
+import logging
+import threading
+import time
+import urllib2
+import BaseHTTPServer
+import SocketServer
+import Queue
+from collections import defaultdict, deque
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
+
+
+logger = logging.getLogger(__name__)
+
+FACET_FILTERS = ('venues', 'exclude_authors', 'boost_venues')
+
+
+class LatencyStats(object):
+    """Thread safe collection of recent latency samples and counters"""
+
+    def __init__(self, window=10000):
+        self._lock = threading.Lock()
+        self._samples = defaultdict(lambda: deque(maxlen=window))
+        self._counters = defaultdict(int)
+
+    def record(self, stage, seconds):
+        with self._lock:
+            self._samples[stage].append(seconds)
+
+    def increment(self, counter, amount=1):
+        with self._lock:
+            self._counters[counter] += amount
+
+    def snapshot(self):
+        """Returns the counters and, for every stage, the number of samples
+        and the mean and percentile latencies in milliseconds"""
+        with self._lock:
+            samples = {stage: np.array(values) * 1000
+                       for stage, values in self._samples.items() if values}
+            counters = dict(self._counters)
+
+        stages = {}
+        for stage, values in samples.items():
+            p50, p95, p99 = np.percentile(values, [50, 95, 99])
+            stages[stage] = {'count': len(values), 'mean_ms': values.mean(),
+                             'p50_ms': p50, 'p95_ms': p95, 'p99_ms': p99}
+        return {'counters': counters, 'stages': stages}
+
+
+class RecommendationService(object):
+    """Answers a batch of queries with the recommender's batched methods,
+    timing the encoding, inference and scoring stages"""
+
+    def __init__(self, recommender, stats, default_num_results=10):
+        self.recommender = recommender
+        self.stats = stats
+        self.default_num_results = default_num_results
+
+    def __call__(self, queries):
+        """
+        Args:
+            queries: list of dicts with a 'text' and optional 'year' and
+                    'num_results' keys
+        Returns:
+            list with a list of (doc_id, score) tuples for every query
+        """
+        recommender = self.recommender
+        stats = self.stats
+        topic_vectors = recommender.texts_to_topic_vectors(
+            [query['text'] for query in queries], record=stats.record)
+        inferred = time.time()
+
+        num_results = [query.get('num_results') or self.default_num_results
+                       for query in queries]
+        years = [query.get('year') for query in queries]
+
+        # queries with the same facet filters are scored together
+        groups = defaultdict(list)
+        for i, query in enumerate(queries):
+            groups[_facet_key(query)].append(i)
+
+        results = [None] * len(queries)
+        for key, indexes in groups.iteritems():
+            group_results = recommender.top_scoring_for_topic_vectors(
+                [topic_vectors[i] for i in indexes],
+                [years[i] for i in indexes],
+                max(num_results[i] for i in indexes),
+                **dict(key))
+            for i, doc_scores in zip(indexes, group_results):
+                results[i] = doc_scores
+        stats.record('score', time.time() - inferred)
+
+        return [doc_scores[:n] for doc_scores, n in zip(results, num_results)]
+
+
+def validate_query(query):
+    """Checks the fields of a /recommend query before it is batched, raises
+    a ValueError describing the first invalid field"""
+    if not isinstance(query, dict):
+        raise ValueError('Query must be a JSON object')
+    if not isinstance(query.get('text'), basestring):
+        raise ValueError("Query needs a 'text' string")
+
+    year = query.get('year')
+    if year is not None and not _is_int(year):
+        raise ValueError("'year' must be an integer")
+    num_results = query.get('num_results')
+    if num_results is not None and \
+            not (_is_int(num_results) and num_results > 0):
+        raise ValueError("'num_results' must be a positive integer")
+
+    for name in FACET_FILTERS:
+        values = query.get(name, [])
+        if not isinstance(values, list) or \
+                not all(isinstance(value, basestring) for value in values):
+            raise ValueError("'{name}' must be a list of strings".format(
+                name=name))
+    return query
+
+
+def _is_int(value):
+    return isinstance(value, (int, long)) and not isinstance(value, bool)
+
+
+def _facet_key(query):
+    """Hashable form of a query's facet filters"""
+    return tuple((name, tuple(query[name])) for name in FACET_FILTERS
+                 if query.get(name) is not None)
+
+
+class _PendingQuery(object):
+
+    def __init__(self, query):
+        self.query = query
+        self.enqueued = time.time()
+        self.result = None
+        self.error = None
+        self._done = threading.Event()
+
+    def set_result(self, result=None, error=None):
+        self.result = result
+        self.error = error
+        self._done.set()
+
+    def wait(self, timeout=None):
+        self._done.wait(timeout)
+        if not self._done.is_set():
+            raise RuntimeError('Query timed out')
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class MicroBatcher(object):
+    """Gathers concurrently submitted queries into batches and processes
+    them in a worker pool
+
+    A batch is dispatched once it holds max_batch_size queries or its first
+    query has waited max_wait seconds.
+    """
+
+    def __init__(self, process_batch, stats, max_batch_size=32,
+                 max_wait=0.005, num_workers=2):
+        self.process_batch = process_batch
+        self.stats = stats
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+
+        self._queue = Queue.Queue()
+        self._pool = ThreadPool(num_workers)
+        self._collector = threading.Thread(target=self._collect)
+        self._collector.daemon = True
+        self._collector.start()
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def submit(self, query, timeout=30):
+        """Queues a query and blocks until its batch has been processed"""
+        pending = _PendingQuery(query)
+        self._queue.put(pending)
+        return pending.wait(timeout)
+
+    def close(self):
+        self._pool.close()
+
+    def _collect(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = batch[0].enqueued + self.max_wait
+
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.time()
+                try:
+                    if remaining > 0:
+                        batch.append(self._queue.get(timeout=remaining))
+                    else:
+                        batch.append(self._queue.get_nowait())
+                except Queue.Empty:
+                    break
+
+            self._pool.apply_async(self._run_batch, (batch,))
+
+    def _run_batch(self, batch):
+        stats = self.stats
+        start = time.time()
+        for pending in batch:
+            stats.record('queue', start - pending.enqueued)
+        stats.increment('batches')
+        stats.increment('queries', len(batch))
+
+        if len(batch) == 1:
+            results = [self._process_one(batch[0])]
+        else:
+            try:
+                results = self.process_batch([pending.query
+                                              for pending in batch])
+            except Exception:
+                # one query at a time, so that a bad query does not fail the
+                # rest of its batch
+                logger.exception('Failed to process batch, retrying its '
+                                 'queries one at a time')
+                stats.increment('batch_retries')
+                results = [self._process_one(pending) for pending in batch]
+
+        finished = time.time()
+        stats.record('batch', finished - start)
+        for pending, result in zip(batch, results):
+            if pending.error is not None:
+                continue
+            stats.record('total', finished - pending.enqueued)
+            pending.set_result(result)
+
+    def _process_one(self, pending):
+        """Processes a single query, failing only that query on errors"""
+        try:
+            return self.process_batch([pending.query])[0]
+        except Exception as error:
+            logger.exception('Failed to process query')
+            self.stats.increment('errors')
+            pending.set_result(error=error)
+
+
+class RecommendationHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path == '/stats':
+            self._send_json(200, self.server.stats_snapshot())
+        elif self.path == '/health':
+            self._send_json(200, {'status': 'ok'})
+        else:
+            self._send_json(404, {'error': 'Not found'})
+
+    def do_POST(self):
+        if self.path != '/recommend':
+            self._send_json(404, {'error': 'Not found'})
+            return
+
+        try:
+            length = int(self.headers.getheader('content-length', 0))
+            query = validate_query(json.loads(self.rfile.read(length)))
+        except ValueError as error:
+            self._send_json(400, {'error': str(error)})
+            return
+
+        try:
+            results = self.server.batcher.submit(query)
+        except Exception as error:
+            self._send_json(500, {'error': str(error)})
+            return
+
+        self._send_json(200, {'results': results})
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+    def _send_json(self, status, body):
+        payload = json.dumps(body)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+class RecommendationServer(SocketServer.ThreadingMixIn,
+                           BaseHTTPServer.HTTPServer):
+
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, address, recommender, max_batch_size=32,
+                 max_wait=0.005, num_workers=2):
+        BaseHTTPServer.HTTPServer.__init__(self, address,
+                                           RecommendationHandler)
+        self.stats = LatencyStats()
+        self.recommender = recommender
+        service = RecommendationService(recommender, self.stats)
+        self.batcher = MicroBatcher(service, self.stats,
+                                    max_batch_size=max_batch_size,
+                                    max_wait=max_wait,
+                                    num_workers=num_workers)
+
+    def stats_snapshot(self):
+        snapshot = self.stats.snapshot()
+        snapshot['queue_depth'] = self.batcher.queue_depth
+        snapshot['query_cache'] = self.recommender.query_cache.stats()
+        counters = snapshot['counters']
+        if counters.get('batches'):
+            snapshot['mean_batch_size'] = counters['queries'] / \
+                counters['batches']
+        return snapshot
+
+    def server_close(self):
+        BaseHTTPServer.HTTPServer.server_close(self)
+        self.batcher.close()
+
+
+def serve(recommender, host='127.0.0.1', port=8000, **kwargs):
+    """Serves recommendations until interrupted, keyword arguments are
+    passed on to RecommendationServer"""
+    server = RecommendationServer((host, port), recommender, **kwargs)
+    logger.info('Serving recommendations on http://%s:%d', host, port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def load_test(url, texts, num_requests=1000, concurrency=16,
+              num_results=10):
+    """Sends recommendation queries to a running server from concurrent
+    threads, cycling through texts
+
+    Returns:
+        dict with the throughput in requests per second, latency
+        percentiles in milliseconds and the number of errors
+    """
+    endpoint = url.rstrip('/') + '/recommend'
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    counter = iter(range(num_requests))
+
+    def worker():
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                return
+
+            body = json.dumps({'text': texts[i % len(texts)],
+                               'num_results': num_results})
+            request = urllib2.Request(endpoint, body,
+                                      {'Content-Type': 'application/json'})
+            start = time.time()
+            try:
+                urllib2.urlopen(request).read()
+            except (urllib2.URLError, IOError):
+                with lock:
+                    errors[0] += 1
+                continue
+            with lock:
+                latencies.append(time.time() - start)
+
+    start = time.time()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+
+    report = {'requests': num_requests, 'errors': errors[0],
+              'concurrency': concurrency, 'elapsed': elapsed,
+              'throughput': len(latencies) / elapsed}
+    if latencies:
+        p50, p95, p99 = np.percentile(np.array(latencies) * 1000,
+                                      [50, 95, 99])
+        report.update({'p50_ms': p50, 'p95_ms': p95, 'p99_ms': p99})
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    subparsers = parser.add_subparsers(dest='command')
+
+    serve_parser = subparsers.add_parser('serve')
+    serve_parser.add_argument('bundle', help='model bundle directory')
+    serve_parser.add_argument('--host', default='127.0.0.1')
+    serve_parser.add_argument('--port', type=int, default=8000)
+    serve_parser.add_argument('--max-batch-size', type=int, default=32)
+    serve_parser.add_argument('--max-wait', type=float, default=0.005,
+                              help='seconds a query waits for its batch')
+    serve_parser.add_argument('--workers', type=int, default=2)
+
+    load_parser = subparsers.add_parser('load-test')
+    load_parser.add_argument('url')
+    load_parser.add_argument('queries', help='file with one query per line')
+    load_parser.add_argument('--requests', type=int, default=1000)
+    load_parser.add_argument('--concurrency', type=int, default=16)
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    if args.command == 'serve':
+        from citemachine.bundle import load_bundle
+        serve(load_bundle(args.bundle), args.host, args.port,
+              max_batch_size=args.max_batch_size, max_wait=args.max_wait,
+              num_workers=args.workers)
+    else:
+        with open(args.queries) as queries:
+            texts = [line.strip() for line in queries if line.strip()]
+        print json.dumps(load_test(args.url, texts, args.requests,
+                                   args.concurrency), indent=2)
+
+
+if __name__ == '__main__':
+    main()
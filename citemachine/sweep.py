@@ -0,0 +1,287 @@
+"""Hyperparameter sweep over LDA recommender configurations
+
+The corpus is preprocessed once, keeping every valid word, and the
+resulting document-term matrix is written to a directory of .npy files.
+Worker processes memory-map those files, so they share one copy of the
+data through the OS page cache, and derive the vocabulary of each
+min/max word count setting by dropping columns instead of preprocessing
+again. Every configuration is trained, evaluated on held-out reference
+retrieval and timed, and the results are ranked by quality next to their
+training time and query latency.
+"""
+from __future__ import division
+
+import itertools
+import json
+import os
+import random
+import sys
+import time
+from multiprocessing import Pool, cpu_count
+
+import numpy as np
+
+from citemachine import evaluation, topic_model
+from citemachine.bundle import BundleReferences
+from citemachine.text_process import CorpusPreprocessor
+
+
+MANIFEST_FILE = 'manifest.json'
+VOCABULARY_FILE = 'vocabulary.json'
+
+ARRAYS = ['doc_ids', 'data', 'indices', 'indptr', 'word_counts', 'years',
+          'citation_counts', 'reference_indptr', 'reference_rows']
+
+
+def prepare_sweep_data(corpus, path, **preprocessor_kwargs):
+    """Preprocesses the corpus once and writes the shared sweep data
+
+    Args:
+        corpus: citation corpus, e.g. a DBLP instance
+        path: directory the data is written to
+        preprocessor_kwargs: passed on to CorpusPreprocessor, the word count
+                limits are left open so every configuration can be derived
+    """
+    preprocessor = CorpusPreprocessor(corpus, min_word_count=1,
+                                      max_word_count=sys.maxint,
+                                      **preprocessor_kwargs)
+    doc_ids, matrix = preprocessor.document_term_matrix()
+    row_of = {doc_id: row for row, doc_id in enumerate(doc_ids)}
+
+    reference_indptr = [0]
+    reference_rows = []
+    for doc_id in doc_ids:
+        reference_rows.extend(sorted(row_of[ref]
+                                     for ref in corpus.references[doc_id]
+                                     if ref in row_of))
+        reference_indptr.append(len(reference_rows))
+
+    arrays = {
+        'doc_ids': np.asarray(doc_ids, dtype=np.int64),
+        'data': matrix.data.astype(np.int32),
+        'indices': matrix.indices.astype(np.int32),
+        'indptr': matrix.indptr.astype(np.int64),
+        'word_counts': np.asarray(matrix.sum(axis=0)).ravel(),
+        'years': np.array([corpus.years[doc] or 0 for doc in doc_ids]),
+        'citation_counts': np.array([corpus.citation_counts[doc]
+                                     for doc in doc_ids]),
+        'reference_indptr': np.asarray(reference_indptr, dtype=np.int64),
+        'reference_rows': np.asarray(reference_rows, dtype=np.int64),
+    }
+
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    for name in ARRAYS:
+        np.save(os.path.join(path, name + '.npy'), arrays[name])
+
+    with open(os.path.join(path, VOCABULARY_FILE), 'w') as vocabulary_file:
+        json.dump([preprocessor.id_to_word_map[word_id]
+                   for word_id in range(preprocessor.vocabulary_size)],
+                  vocabulary_file)
+    with open(os.path.join(path, MANIFEST_FILE), 'w') as manifest_file:
+        json.dump({'num_docs': len(doc_ids),
+                   'vocabulary_size': preprocessor.vocabulary_size},
+                  manifest_file)
+
+
+def load_sweep_data(path):
+    """Memory-maps the arrays written by 'prepare_sweep_data'"""
+    with open(os.path.join(path, MANIFEST_FILE)) as manifest_file:
+        data = json.load(manifest_file)
+    for name in ARRAYS:
+        data[name] = np.load(os.path.join(path, name + '.npy'),
+                             mmap_mode='r')
+    return data
+
+
+def sweep_configurations(num_topics, min_word_counts, max_word_counts):
+    """Grid of every combination of the given values"""
+    return [{'num_topics': topics, 'min_word_count': min_count,
+             'max_word_count': max_count}
+            for topics, min_count, max_count
+            in itertools.product(num_topics, min_word_counts, max_word_counts)
+            if min_count <= max_count]
+
+
+def run_sweep(path, configurations, sample_size=1000, ks=(10,),
+              num_queries=50, num_workers=None, seed=0, rank_by=None,
+              report_path=None):
+    """Trains and evaluates LDA configurations concurrently
+
+    Args:
+        path: directory written by 'prepare_sweep_data'
+        configurations: list of dicts with 'num_topics', 'min_word_count'
+                and 'max_word_count' keys, see 'sweep_configurations'
+        sample_size: number of documents whose references are retrieved
+        ks: cutoffs of the evaluation metrics
+        num_queries: number of single queries timed per configuration
+        num_workers: number of worker processes, defaults to the CPU count
+        seed: seed of the evaluation sample
+        rank_by: metric the configurations are ranked by, 'MAP' by default
+        report_path: if given, the ranked results are written there as JSON
+    Returns:
+        list of result dicts, best first, each with the configuration, its
+        metrics, 'train_seconds', 'query_ms' and whether it is
+        'pareto_optimal' in quality, training time and query latency
+    """
+    rank_by = rank_by or 'MAP'
+    metric_names = evaluation.metric_names(ks)
+    if rank_by not in metric_names:
+        raise ValueError('Cannot rank by {metric}, the metrics of ks {ks} '
+                         'are {names}'.format(metric=rank_by, ks=list(ks),
+                                              names=', '.join(metric_names)))
+    tasks = [(path, configuration, sample_size, tuple(ks), num_queries, seed)
+             for configuration in configurations]
+
+    if num_workers is None:
+        num_workers = cpu_count()
+    num_workers = min(num_workers, len(tasks))
+
+    if num_workers > 1:
+        pool = Pool(num_workers)
+        try:
+            results = pool.map(_run_configuration, tasks, chunksize=1)
+        finally:
+            pool.terminate()
+    else:
+        results = [_run_configuration(task) for task in tasks]
+
+    # configurations without evaluated documents have no metrics
+    results.sort(key=lambda result: result['metrics'].get(rank_by, 0),
+                 reverse=True)
+    _mark_pareto_optimal(results, rank_by)
+
+    if report_path is not None:
+        with open(report_path, 'w') as report_file:
+            json.dump({'rank_by': rank_by, 'results': results}, report_file,
+                      indent=2, sort_keys=True)
+
+    return results
+
+
+class SweepCorpus(object):
+    """Streamed gensim corpus over the memory-mapped document-term matrix
+
+    Only the columns of the kept words are read, renumbered in the order of
+    'kept_words', so the rows are never copied into lists of bag of words
+    up front. Supports len(), iteration and indexing by row or slice.
+    """
+
+    def __init__(self, data, kept_words):
+        self.indptr = data['indptr']
+        self.indices = data['indices']
+        self.counts = data['data']
+        self.num_docs = data['num_docs']
+        self.column_map = np.full(data['vocabulary_size'], -1, dtype=np.int64)
+        self.column_map[kept_words] = np.arange(len(kept_words))
+
+    def __len__(self):
+        return self.num_docs
+
+    def __iter__(self):
+        for row in xrange(self.num_docs):
+            yield self[row]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[row] for row in xrange(*index.indices(self.num_docs))]
+        start, end = self.indptr[index], self.indptr[index + 1]
+        columns = self.column_map[self.indices[start:end]]
+        is_kept = columns >= 0
+        return zip(columns[is_kept].tolist(),
+                   np.asarray(self.counts[start:end])[is_kept].tolist())
+
+
+class SweepRecommender(object):
+    """Scores the documents of a trained configuration, identified by their
+    row, with the interface 'evaluation.evaluate' needs"""
+
+    def __init__(self, topic_matrix, years, citation_counts):
+        self.topic_matrix = topic_matrix
+        self.years = years
+        self.citation_counts = citation_counts
+        self.rows = np.arange(len(topic_matrix))
+
+    def top_scoring_for_docs(self, rows, num_results=10):
+        cutoffs = topic_model.document_year_cutoffs(self.years[rows])
+        return self.top_scoring_for_topic_matrix(self.topic_matrix[rows],
+                                                 cutoffs, num_results)
+
+    def top_scoring_for_topic_matrix(self, query_matrix, cutoffs,
+                                     num_results=10):
+        return topic_model.top_scoring_batch(
+            query_matrix, self.topic_matrix, self.rows, self.years,
+            self.citation_counts, cutoffs, num_results)
+
+
+def _run_configuration(task):
+    path, configuration, sample_size, ks, num_queries, seed = task
+    data = load_sweep_data(path)
+
+    word_counts = data['word_counts']
+    kept_words = np.flatnonzero(
+        (word_counts >= configuration['min_word_count']) &
+        (word_counts <= configuration['max_word_count']))
+    corpus = SweepCorpus(data, kept_words)
+
+    with open(os.path.join(path, VOCABULARY_FILE)) as vocabulary_file:
+        vocabulary = json.load(vocabulary_file)
+    id2word = {new_id: vocabulary[word_id]
+               for new_id, word_id in enumerate(kept_words.tolist())}
+
+    from gensim.models.ldamodel import LdaModel
+    num_topics = configuration['num_topics']
+    start = time.time()
+    lda = LdaModel(corpus, num_topics=num_topics, id2word=id2word)
+    train_seconds = time.time() - start
+
+    topic_vectors = topic_model.batch_infer_topics(lda, corpus)
+    _, topic_matrix = topic_model.topics_dict_to_matrix(
+        dict(enumerate(topic_vectors)), num_topics, range(len(corpus)))
+    recommender = SweepRecommender(topic_matrix, np.asarray(data['years']),
+                                   np.asarray(data['citation_counts']))
+    references = BundleReferences(recommender.rows, data['reference_indptr'],
+                                  data['reference_rows'])
+
+    candidates = [row for row, refs in references.items() if len(refs)]
+    if sample_size is not None and sample_size < len(candidates):
+        candidates = random.Random(seed).sample(candidates, sample_size)
+
+    # the pool workers are daemonic and cannot start a pool of their own
+    report = evaluation.evaluate(recommender, doc_ids=candidates,
+                                 references=references, sample_size=None,
+                                 ks=ks, num_workers=1)
+
+    # single query latency: inference of a document plus scoring
+    latencies = []
+    for row in candidates[:num_queries]:
+        start = time.time()
+        query_topics = lda[corpus[row]]
+        recommender.top_scoring_for_topic_matrix(
+            topic_model.topics_to_dense(query_topics, num_topics)[np.newaxis],
+            topic_model.document_year_cutoffs(recommender.years[[row]]),
+            max(ks))
+        latencies.append(time.time() - start)
+
+    return {'configuration': configuration,
+            'vocabulary_size': len(kept_words),
+            'num_evaluated': report['num_docs'],
+            'metrics': report['metrics'],
+            'train_seconds': train_seconds,
+            'query_ms': float(np.median(latencies) * 1000) if latencies
+                        else None}
+
+
+def _mark_pareto_optimal(results, rank_by):
+    """A configuration is pareto optimal if no other one is at least as
+    good in quality, training time and query latency, and better in one"""
+    def objectives(result):
+        return (-result['metrics'].get(rank_by, 0), result['train_seconds'],
+                result['query_ms'] or 0)
+
+    for result in results:
+        own = objectives(result)
+        result['pareto_optimal'] = not any(
+            all(o <= s for o, s in zip(objectives(other), own)) and
+            objectives(other) != own
+            for other in results)
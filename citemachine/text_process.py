@@ -1,8 +1,25 @@
 from collections import Counter, defaultdict
-from nltk import word_tokenize
+
+from citemachine import instrument
+from citemachine import topic_model
 from citemachine.util import stem_all, BiDirMap, filter_dict
-from nltk.stem.lancaster import LancasterStemmer
-from nltk.corpus import stopwords
+
+
+def _preprocess_counts(result, preprocessor, *args, **kwargs):
+    return {'docs': len(preprocessor.words),
+            'tokens_stemmed': preprocessor._num_tokens,
+            'vocabulary': len(preprocessor._valid_words)}
+
+
+class _DefaultWordFilter(object):
+    """Keeps words longer than two characters that are not excluded, a class
+    instead of a lambda so that preprocessors can be pickled"""
+
+    def __init__(self, excluded_words):
+        self.excluded_words = excluded_words
+
+    def __call__(self, word):
+        return (len(word) > 2) and (word not in self.excluded_words)
 
 
 class CorpusPreprocessor(object):
@@ -19,6 +36,7 @@ class CorpusPreprocessor(object):
                         *For normal id to word lookup use the 'to_word' method
     """
 
+    @instrument.instrumented('preprocess', counts=_preprocess_counts)
     def __init__(self, corpus, tokenize=None, stemmer=None,
                  excluded_words=None, is_valid_word=None, min_word_count=5,
                  max_word_count=500):
@@ -38,6 +56,7 @@ class CorpusPreprocessor(object):
         """
         self._corpus = corpus
         self._word_counts = defaultdict(int)
+        self._term_matrix = None
 
         self._initialize_preprocessing_tools(tokenize, stemmer, excluded_words,
                                              is_valid_word)
@@ -49,6 +68,48 @@ class CorpusPreprocessor(object):
         """Dictionary from word id to word"""
         return self._word_to_id_map.val_to_key
 
+    @property
+    def vocabulary_size(self):
+        """Number of word ids assigned by the preprocessor"""
+        return len(self._word_to_id_map.key_to_val)
+
+    def __getstate__(self):
+        # the term matrix is derived from the number encodings
+        state = self.__dict__.copy()
+        state['_term_matrix'] = None
+        return state
+
+    @property
+    def term_matrix(self):
+        """Sparse (CSR) matrix of word counts of all documents, built once
+        from the number encodings, returned as (doc_ids, doc_index, matrix)
+        where doc_index maps a document id to its row"""
+        if getattr(self, '_term_matrix', None) is None:
+            doc_ids = list(self.number_encodings.keys())
+            bows = [self.number_encodings[doc_id] for doc_id in doc_ids]
+            matrix = topic_model.bows_to_sparse_rows(bows,
+                                                     self.vocabulary_size)
+            doc_index = {doc: i for i, doc in enumerate(doc_ids)}
+            self._term_matrix = (doc_ids, doc_index, matrix)
+        return self._term_matrix
+
+    def document_term_matrix(self, doc_ids=None):
+        """Sparse (CSR) matrix of word counts, with one row per document and
+        one column per word id, sliced from 'term_matrix'
+
+        Args:
+            doc_ids: documents to include, in row order, defaults to all
+                    documents of the corpus
+        Returns:
+            doc_ids: list of document ids, in row order
+            matrix: scipy.sparse.csr_matrix of shape
+                    (len(doc_ids), vocabulary_size)
+        """
+        all_doc_ids, doc_index, matrix = self.term_matrix
+        if doc_ids is None:
+            return list(all_doc_ids), matrix
+        return doc_ids, matrix[[doc_index[doc_id] for doc_id in doc_ids]]
+
     def preprocess_text(self, text):
         """Turns a string of text into a representation that is consistent
         with the representation used for the original corpus
@@ -79,24 +140,28 @@ class CorpusPreprocessor(object):
 
     def _initialize_preprocessing_tools(self, tokenize, stemmer,
                                         excluded_words, is_valid_word):
+        # nltk is slow to import, so it is only loaded when its defaults
+        # are needed
         if stemmer:
             self.stemmer = stemmer
         else:
+            from nltk.stem.lancaster import LancasterStemmer
             self.stemmer = LancasterStemmer()
 
         if excluded_words:
             self.excluded_words = set(stem_all(excluded_words, self.stemmer))
         else:
+            from nltk.corpus import stopwords
             self.excluded_words = set(stem_all(stopwords.words('english'),
                                       self.stemmer))
 
         if is_valid_word is None:
-            self.is_valid_word = lambda word: (len(word) > 2) and \
-                                              (word not in self.excluded_words)
+            self.is_valid_word = _DefaultWordFilter(self.excluded_words)
         else:
             self.is_valid_word = is_valid_word
 
         if tokenize is None:
+            from nltk import word_tokenize
             self.tokenize = word_tokenize
         else:
             self.tokenize = tokenize
@@ -109,9 +174,11 @@ class CorpusPreprocessor(object):
         texts = self._corpus.texts
         split_text = self._split_text
         filter_words = self._filter_words
+        num_tokens = 0
 
         for doc_id in texts.keys():
             ws = split_text(texts[doc_id])
+            num_tokens += len(ws)
 
             for word in ws:
                 word_counts[word] += 1
@@ -137,6 +204,7 @@ class CorpusPreprocessor(object):
 
         self._word_to_id_map = word_to_id_map
         self.words = words
+        self._num_tokens = num_tokens
 
     def _split_text(self, text):
         words = self.tokenize(text)
@@ -1,6 +1,26 @@
+from __future__ import division
+
+from datetime import date
 from operator import itemgetter
 
+import numpy as np
+import scipy.sparse as sp
+from scipy.special import psi
+
+from citemachine import instrument
+
+
+# peak bytes per (query, document) cell while scoring a batch: the float32
+# scores plus the float32 buffer 'histogram_intersection_block' accumulates
+# them through, the boolean filter masks only come after it is freed
+SCORE_BYTES_PER_CELL = 4 + 4
+
+
+def _topics_dict_counts(topics, *args, **kwargs):
+    return {'docs': len(topics)}
+
 
+@instrument.instrumented('lda.build_topics_dict', counts=_topics_dict_counts)
 def build_topics_dict(lda, number_encodings_dict):
     topics = {}
     for doc_id in number_encodings_dict:
@@ -9,6 +29,104 @@ def build_topics_dict(lda, number_encodings_dict):
     return topics
 
 
+def batch_infer_topics(lda, bows, chunksize=2000):
+    """Infers the topic vectors of many number encoded documents at once
+
+    Equivalent to [lda[bow] for bow in bows], but runs the variational
+    inference on whole chunks of documents instead of one at a time.
+
+    Args:
+        lda: trained gensim LdaModel
+        bows: list of number encoded word vectors
+        chunksize: number of documents inferred together
+    Returns:
+        list of topic vectors, lists of (topic_id, probability) tuples
+    """
+    min_probability = getattr(lda, 'minimum_probability', 0.01)
+
+    topic_vectors = []
+    for start in range(0, len(bows), chunksize):
+        gamma, _ = lda.inference(bows[start:start + chunksize])
+        distributions = gamma / gamma.sum(axis=1)[:, np.newaxis]
+        for distribution in distributions:
+            topic_vectors.append([(topic, prob) for topic, prob
+                                  in enumerate(distribution.tolist())
+                                  if prob >= min_probability])
+    return topic_vectors
+
+
+def dirichlet_expectation(alpha):
+    """Expected value of log(theta) for theta ~ Dirichlet(alpha)"""
+    return psi(alpha) - psi(alpha.sum())
+
+
+def infer_topics(bow, alpha, exp_elog_beta, iterations=50,
+                 gamma_threshold=0.001, min_probability=0.01):
+    """Infers the topic vector of a number encoded document from a trained
+    LDA's parameters, without needing the gensim model
+
+    Runs the same variational E-step as gensim's LdaModel.inference.
+
+    Args:
+        bow: number encoded word vector
+        alpha: numpy array of the topic priors
+        exp_elog_beta: (num_topics, num_words) array, the LDA's expElogbeta
+        iterations / gamma_threshold: stopping criteria of the inference
+        min_probability: topics with lower probability are left out
+    Returns:
+        topic vector, list of (topic_id, probability) tuples
+    """
+    if not bow:
+        gamma = np.asarray(alpha, dtype=np.float64)
+    else:
+        word_ids = [word_id for word_id, count in bow]
+        counts = np.array([count for word_id, count in bow],
+                          dtype=np.float64)
+        exp_elog_beta_d = exp_elog_beta[:, word_ids]
+
+        gamma = np.ones(len(alpha))
+        exp_elog_theta = np.exp(dirichlet_expectation(gamma))
+        phinorm = exp_elog_theta.dot(exp_elog_beta_d) + 1e-100
+        for _ in range(iterations):
+            last_gamma = gamma
+            gamma = alpha + exp_elog_theta * \
+                np.dot(counts / phinorm, exp_elog_beta_d.T)
+            exp_elog_theta = np.exp(dirichlet_expectation(gamma))
+            phinorm = exp_elog_theta.dot(exp_elog_beta_d) + 1e-100
+            if np.mean(np.abs(gamma - last_gamma)) < gamma_threshold:
+                break
+
+    distribution = gamma / gamma.sum()
+    return [(topic, prob) for topic, prob in enumerate(distribution.tolist())
+            if prob >= min_probability]
+
+
+def bows_to_sparse_rows(bows, num_words):
+    """Turns number encoded word vectors into the rows of a CSR matrix, the
+    inverse of 'sparse_rows_to_bows'"""
+    indptr = np.zeros(len(bows) + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum([len(bow) for bow in bows])
+    pairs = np.fromiter((value for bow in bows for pair in bow
+                         for value in pair),
+                        dtype=np.int64, count=2 * indptr[-1]).reshape(-1, 2)
+    return sp.csr_matrix((pairs[:, 1], pairs[:, 0], indptr),
+                         shape=(len(bows), num_words))
+
+
+def sparse_rows_to_bows(matrix):
+    """Turns the rows of a CSR matrix into number encoded word vectors"""
+    indptr = matrix.indptr
+    indices = matrix.indices
+    data = matrix.data
+
+    bows = []
+    for row in range(matrix.shape[0]):
+        start, end = indptr[row], indptr[row + 1]
+        bows.append(zip(indices[start:end].tolist(),
+                        data[start:end].tolist()))
+    return bows
+
+
 def topic_intersection(doc1_topics, doc2_topics):
     """Computes the intersection of the topic vectors"""
     p1 = 0
@@ -39,6 +157,132 @@ def histogram_intersection_kernel(topics1, topics2):
     return score
 
 
+def topics_to_dense(topic_vector, num_topics):
+    """Turns a sparse topic vector into a dense numpy array"""
+    dense = np.zeros(num_topics, dtype=np.float32)
+    for topic, prob in topic_vector:
+        dense[topic] = prob
+    return dense
+
+
+def topics_dict_to_matrix(topics_dict, num_topics, doc_ids=None):
+    """Stacks the topic vectors of a topics dict into a dense matrix
+
+    Returns:
+        doc_ids: list of document ids, in row order
+        matrix: numpy array of shape (len(doc_ids), num_topics)
+    """
+    if doc_ids is None:
+        doc_ids = list(topics_dict.keys())
+
+    matrix = np.zeros((len(doc_ids), num_topics), dtype=np.float32)
+    for row, doc_id in enumerate(doc_ids):
+        for topic, prob in topics_dict[doc_id]:
+            matrix[row, topic] = prob
+    return doc_ids, matrix
+
+
+def histogram_intersection_scores(query_topics, topic_matrix):
+    """Vectorized histogram intersection kernel of a dense query topic vector
+    against every row of a dense topic matrix"""
+    return np.minimum(topic_matrix, query_topics).sum(axis=1)
+
+
+def histogram_intersection_block(query_matrix, topic_matrix):
+    """Histogram intersection kernel of every row of query_matrix against
+    every row of topic_matrix
+
+    Accumulates one topic at a time into the score matrix through a single
+    reused buffer of the same shape.
+    """
+    scores = np.zeros((query_matrix.shape[0], topic_matrix.shape[0]),
+                      dtype=np.float32)
+    buffer = np.empty_like(scores)
+    for topic in range(query_matrix.shape[1]):
+        query_column = query_matrix[:, topic]
+        if not query_column.any():
+            continue
+        np.minimum(query_column[:, np.newaxis],
+                   topic_matrix[np.newaxis, :, topic], out=buffer)
+        scores += buffer
+    return scores
+
+
+def top_k_indices(scores, k):
+    """Returns the indices of the k highest scores, sorted by score, using a
+    partial sort, ties are broken by the lower index"""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.array([], dtype=np.intp)
+
+    kth_score = scores[np.argpartition(-scores, k - 1)[k - 1]]
+    # all candidates tied with the kth score, in index order
+    candidates = np.flatnonzero(scores >= kth_score)
+    order = np.argsort(-scores[candidates], kind='mergesort')
+    return candidates[order[:k]]
+
+
+@instrument.timed('topic_model.top_scoring_batch')
+def top_scoring_batch(query_matrix, topic_matrix, doc_ids, years,
+                      citation_counts, publication_years, num_results,
+                      row_mask=None, row_weights=None):
+    """Scores a batch of dense query topic vectors against the corpus in one
+    pass and applies the same filters as 'filter_scores' to each query
+
+    Args:
+        query_matrix: (num_queries, num_topics) dense query topic vectors
+        topic_matrix: (num_docs, num_topics) dense document topic vectors
+        doc_ids / years / citation_counts: sequences aligned with the rows
+                of topic_matrix
+        publication_years: sequence of the year cutoff of every query
+        num_results: number of results returned per query, all valid
+                documents if None
+        row_mask: optional boolean array over the documents, or one per
+                query, documents that are False are filtered out
+        row_weights: optional array of score multipliers over the documents
+    Returns:
+        list with a list of (doc_id, score) tuples for every query
+    """
+    if num_results is None:
+        num_results = len(doc_ids)
+
+    scores = histogram_intersection_block(query_matrix, topic_matrix)
+    if row_weights is not None:
+        scores *= row_weights
+
+    is_invalid = np.asarray(years)[np.newaxis, :] > \
+        np.asarray(publication_years)[:, np.newaxis]
+    is_invalid |= np.asarray(citation_counts) <= 0
+    if row_mask is not None:
+        is_invalid |= ~row_mask
+    scores[is_invalid] = -np.inf
+
+    results = []
+    for row_scores in scores:
+        top = top_k_indices(row_scores, num_results)
+        results.append([(doc_ids[i], float(row_scores[i])) for i in top
+                        if row_scores[i] != -np.inf])
+    return results
+
+
+def year_cutoffs(publication_years, num_queries):
+    """Fills in the current year for queries without a publication year"""
+    this_year = date.today().year
+    if publication_years is None:
+        return [this_year] * num_queries
+    return [this_year if year is None else year
+            for year in publication_years]
+
+
+def document_year_cutoffs(years):
+    """Year cutoffs of corpus documents used as queries, 'years' is a filter
+    column where unknown years are 0, those get the current year like
+    queries without a publication year in 'year_cutoffs'"""
+    years = np.asarray(years)
+    return np.where(years > 0, years, date.today().year)
+
+
+@instrument.timed('topic_model.score_topics')
 def score_topics(query_topics, topics_dict,
                  similarity_func=histogram_intersection_kernel):
     """Scores the topics in the query against all topics in the topics_dict
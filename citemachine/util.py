@@ -1,4 +1,7 @@
-from collections import defaultdict
+from __future__ import division
+
+import threading
+from collections import defaultdict, OrderedDict
 
 def filter_dict(func, dictionary):
     """Filter a dictionary *in place* based on filter function
@@ -41,3 +44,70 @@ class BiDirMap(object):
 
     def get_value(self, key):
         return self.key_to_val(key)
+
+
+class LRUCache(object):
+    """Bounded mapping that evicts the least recently used items and keeps
+    track of its hit rate, safe to share between threads"""
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # locks can not be pickled
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key, default=None):
+        """Returns the cached value and marks it as recently used"""
+        with self._lock:
+            try:
+                value = self._items.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+
+            self._items[key] = value
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._items.pop(key, None)
+            self._items[key] = value
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.hits = 0
+            self.misses = 0
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'hit_rate': self.hit_rate, 'size': len(self._items),
+                    'maxsize': self.maxsize}
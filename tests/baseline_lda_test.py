@@ -5,7 +5,7 @@ os.chdir('..')
 from citemachine.corpus.dblp import DBLP
 from citemachine import topic_model
 from citemachine.text_process import CorpusPreprocessor
-from citemachine.evaluation import precision, recall
+from citemachine.evaluation import precision, recall, evaluate
 from citemachine.recommender import LDARecommender
 from cloud.serialization import cloudpickle
 import cPickle
@@ -62,6 +62,18 @@ def recommendation_ranking_test(recommender, docs_range=(0,10), num_results=10):
     print "Mean Precision: {p} | Mean Recall: {r}".format(p=sum(precisions)/len(precisions), r=sum(recalls)/len(precisions))
 
 
+def evaluation_report_test(recommender, sample_size=1000,
+                           report_path='evaluation_report.json'):
+
+    report = evaluate(recommender, sample_size=sample_size,
+                      report_path=report_path)
+
+    print "Evaluated {n} documents in {t:.1f}s".format(n=report['num_docs'],
+                                                     t=report['elapsed'])
+    for name, value in sorted(report['metrics'].items()):
+        print "{name}: {value}".format(name=name, value=value)
+
+
 def main(recommender_pickle_path=None):
 
     if recommender_pickle_path:
@@ -70,6 +82,7 @@ def main(recommender_pickle_path=None):
     else:
         recommender = lda_recommender_setup(num_docs=5000, num_topics=50)
     recommendation_ranking_test(recommender)
+    evaluation_report_test(recommender)
 
 
 if __name__ == '__main__':
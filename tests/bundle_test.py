@@ -0,0 +1,186 @@
+from __future__ import division
+
+import os
+import random
+import shutil
+import sys
+import tempfile
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from citemachine import topic_model
+from citemachine.bundle import BundleReferences, load_bundle, save_bundle
+from citemachine.corpus.facets import FacetIndex
+from citemachine.recommender import LDARecommender
+from citemachine.text_process import CorpusPreprocessor
+
+
+class TinyCorpus(object):
+    """Documents of four groups drawing their words from four disjoint
+    vocabularies, citing documents of their own group"""
+
+    def __init__(self, num_docs=120, seed=0):
+        rs = random.Random(seed)
+        vocabulary = ['word%d' % i for i in range(80)]
+        self.titles = {}
+        self.abstracts = {}
+        self.years = {}
+        self.citation_counts = {}
+        self.references = {}
+        self.authors = {}
+        self.conferences = {}
+        for doc_id in range(num_docs):
+            group = doc_id % 4
+            self.titles[doc_id] = 'title %d' % doc_id
+            self.abstracts[doc_id] = ' '.join(
+                rs.choice(vocabulary[group * 20:group * 20 + 20])
+                for _ in range(30))
+            # one document without a year, the rest spread over a decade
+            self.years[doc_id] = None if doc_id == 7 else \
+                2000 + rs.randint(0, 10)
+            self.citation_counts[doc_id] = rs.randint(0, 4)
+            self.references[doc_id] = [ref for ref in
+                                       rs.sample(range(num_docs), 6)
+                                       if ref % 4 == group and ref != doc_id]
+            self.authors[doc_id] = ['author%d' % rs.randint(0, 20)]
+            self.conferences[doc_id] = 'venue%d' % group
+        self.texts = self
+        self.author_index = FacetIndex(self.authors)
+        self.venue_index = FacetIndex(self.conferences)
+
+    def __getitem__(self, doc_id):
+        return self.titles[doc_id] + ' ' + self.abstracts[doc_id]
+
+    def keys(self):
+        return self.titles.keys()
+
+
+class IdentityStemmer(object):
+
+    def stem(self, word):
+        return word
+
+
+def split(text):
+    return text.split()
+
+
+def trained_recommender():
+    # gensim draws its initialization from numpy's global random state
+    np.random.seed(0)
+    corpus = TinyCorpus()
+    preprocessor = CorpusPreprocessor(corpus, tokenize=split,
+                                      stemmer=IdentityStemmer(),
+                                      excluded_words=['title'],
+                                      min_word_count=2)
+    return LDARecommender(corpus, preprocessor, num_topics=4,
+                          train_at_init=True)
+
+
+def infer_topics_test(recommender):
+    lda = recommender.LDA
+    for doc_id in range(0, 120, 7):
+        bow = recommender.preprocessor.number_encodings[doc_id]
+        expected = topic_model.topics_to_dense(lda[bow], 4)
+        inferred = topic_model.topics_to_dense(
+            topic_model.infer_topics(bow, lda.alpha, lda.expElogbeta), 4)
+        # gensim starts from a random gamma, on documents mixing topics its
+        # own results vary by a few hundredths between runs
+        assert np.abs(inferred - expected).max() < 0.05
+
+    # an empty document gets the prior
+    prior = topic_model.infer_topics([], lda.alpha, lda.expElogbeta)
+    assert np.allclose(topic_model.topics_to_dense(prior, 4),
+                       lda.alpha / lda.alpha.sum())
+
+
+def round_trip_test(recommender, bundle):
+    corpus = recommender.corpus
+    doc_ids, _, topic_matrix = recommender.topic_matrix
+    assert bundle.doc_ids.tolist() == doc_ids
+    assert np.array_equal(bundle.topic_matrix, topic_matrix)
+    assert bundle.years.tolist() == [corpus.years[doc] or 0
+                                     for doc in doc_ids]
+    assert bundle.title(5) == corpus.titles[5]
+    assert bundle.facets.mask(venues=['venue1']).sum() == 30
+
+    references = bundle.references
+    assert len(references) == len(doc_ids)
+    for doc_id in doc_ids:
+        assert references[doc_id].tolist() == corpus.references[doc_id]
+
+
+def ranking_parity_test(recommender, bundle):
+    def ids(results):
+        return [doc for doc, score in results]
+
+    doc_ids = range(0, 120, 5)
+    for doc_id in doc_ids:
+        expected = recommender.top_scoring_for_doc(doc_id, 10)
+        actual = bundle.top_scoring_for_doc(doc_id, 10)
+        assert ids(actual) == ids(expected)
+        assert np.allclose([s for _, s in actual], [s for _, s in expected])
+    assert bundle.top_scoring_for_docs(doc_ids, 10) == \
+        recommender.top_scoring_for_docs(doc_ids, 10)
+
+    # text queries: the same encoding, inference within gensim's spread, and
+    # the same ranking of the inferred topic vector
+    corpus = recommender.corpus
+    for doc_id in [3, 7, 50]:
+        text = corpus[doc_id]
+        assert sorted(bundle.text_to_number_encoding(text)) == \
+            sorted(recommender.text_to_number_encoding(text))
+
+        actual = bundle.top_scoring_for_text(text, 2010, 10)
+        expected = recommender.top_scoring_for_text(text, 2010, 10)
+        assert np.allclose([s for _, s in actual], [s for _, s in expected],
+                           atol=0.05)
+
+        topic_vector = bundle.text_to_topic_vector(text)
+        expected = recommender.top_scoring_for_topics(topic_vector, 2010, 10)
+        assert ids(actual) == ids(expected)
+        assert np.allclose([s for _, s in actual], [s for _, s in expected])
+
+        filtered = bundle.top_scoring_for_text(text, 2010, 10,
+                                               venues=['venue3'])
+        assert ids(filtered) == ids(recommender.top_scoring_for_topics(
+            topic_vector, 2010, 10, venues=['venue3']))
+
+
+def bundle_references_test():
+    references = BundleReferences(np.array([2, 5, 9]), np.array([0, 2, 2, 3]),
+                                  np.array([5, 9, 2]))
+    assert len(references) == 3
+    assert 5 in references and 4 not in references and 10 not in references
+    assert references[2].tolist() == [5, 9]
+    assert references[5].tolist() == []
+    assert references.keys() == [2, 5, 9]
+    assert [(doc, refs.tolist()) for doc, refs in references.items()] == \
+        [(2, [5, 9]), (5, []), (9, [2])]
+    try:
+        references[4]
+    except KeyError:
+        pass
+    else:
+        assert False, 'missing document has references'
+
+
+def main():
+    recommender = trained_recommender()
+    path = tempfile.mkdtemp()
+    try:
+        save_bundle(recommender, path)
+        bundle = load_bundle(path, tokenize=split, stemmer=IdentityStemmer())
+        infer_topics_test(recommender)
+        round_trip_test(recommender, bundle)
+        ranking_parity_test(recommender, bundle)
+    finally:
+        shutil.rmtree(path)
+    bundle_references_test()
+    print 'bundle tests passed'
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+import os
+import shutil
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from citemachine.cli import Workspace
+
+
+def record(workspace, stage, completed):
+    workspace.record(stage, {})
+    workspace.stages[stage]['completed'] = completed
+    open(workspace.artifact(stage), 'w').close()
+
+
+def rerun_upstream_test():
+    path = tempfile.mkdtemp()
+    try:
+        workspace = Workspace(path)
+        record(workspace, 'parse', 1)
+        record(workspace, 'preprocess', 2)
+        record(workspace, 'train', 3)
+        assert workspace.is_complete('train', {})
+        assert not workspace.is_complete('train', {'num_topics': 10})
+
+        # rerunning parse makes every stage downstream of it stale
+        record(workspace, 'parse', 4)
+        assert not workspace.is_complete('preprocess')
+        assert not workspace.is_complete('train')
+
+        record(workspace, 'preprocess', 5)
+        assert workspace.is_complete('preprocess')
+        assert not workspace.is_complete('train')
+        record(workspace, 'train', 6)
+        assert workspace.is_complete('train')
+
+        # a missing upstream artifact makes its dependents stale as well
+        os.remove(workspace.artifact('parse'))
+        assert not workspace.is_complete('train')
+    finally:
+        shutil.rmtree(path)
+
+
+def main():
+    rerun_upstream_test()
+    print 'cli tests passed'
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+from __future__ import division
+
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from citemachine import evaluation
+from citemachine.topic_model import SCORE_BYTES_PER_CELL
+
+
+def close(a, b):
+    return abs(a - b) < 1e-9
+
+
+def ranking_metrics_test():
+    # relevant documents at ranks 1 and 3, out of 3 relevant documents
+    hits = np.array([True, False, True, False, False])
+
+    assert close(evaluation.precision_at_k(hits, 2), 1 / 2)
+    assert close(evaluation.precision_at_k(hits, 5), 2 / 5)
+    assert close(evaluation.recall_at_k(hits, 3, 5), 2 / 3)
+    assert close(evaluation.F1_at_k(hits, 3, 5), 1 / 2)
+    assert close(evaluation.average_precision(hits, 3), (1 + 2 / 3) / 3)
+    assert close(evaluation.reciprocal_rank(hits), 1.0)
+
+    dcg = 1 + 1 / np.log2(4)
+    ideal = 1 + 1 / np.log2(3) + 1 / np.log2(4)
+    assert close(evaluation.ndcg_at_k(hits, 3, 5), dcg / ideal)
+    # only the first k ranks count
+    assert close(evaluation.ndcg_at_k(hits, 3, 1), 1.0)
+
+
+def late_and_missing_hits_test():
+    hits = np.array([False, True, False])
+    assert close(evaluation.reciprocal_rank(hits), 1 / 2)
+    assert close(evaluation.average_precision(hits, 1), 1 / 2)
+    assert close(evaluation.ndcg_at_k(hits, 1, 3), 1 / np.log2(3))
+
+    misses = np.zeros(3, dtype=bool)
+    assert evaluation.average_precision(misses, 2) == 0.0
+    assert evaluation.reciprocal_rank(misses) == 0.0
+    assert evaluation.ndcg_at_k(misses, 2, 3) == 0.0
+    assert evaluation.F1_at_k(misses, 2, 3) == 0.0
+
+
+def score_ranking_test():
+    metrics = evaluation.score_ranking([5, 9, 7, 1, 3], np.array([1, 5, 8]),
+                                       ks=(2, 5))
+    assert close(metrics['precision@2'], 1 / 2)
+    assert close(metrics['recall@5'], 2 / 3)
+    assert close(metrics['MRR'], 1.0)
+    assert close(metrics['MAP'], (1 + 2 / 4) / 3)
+    assert sorted(metrics) == ['F1@2', 'F1@5', 'MAP', 'MRR', 'nDCG@2',
+                               'nDCG@5', 'precision@2', 'precision@5',
+                               'recall@2', 'recall@5']
+    assert sorted(evaluation.metric_names((2, 5))) == sorted(metrics)
+
+
+class RecordingRecommender(object):
+    """Recommends every document's lower neighbour, records its batches"""
+
+    def __init__(self, num_docs):
+        self.topic_matrix = np.zeros((num_docs, 4), dtype=np.float32)
+        self.batches = []
+
+    def top_scoring_for_docs(self, doc_ids, num_results):
+        self.batches.append(len(doc_ids))
+        return [[(doc_id, 1.0), (doc_id - 1, 0.5)] for doc_id in doc_ids]
+
+
+def memory_limited_batches_test():
+    recommender = RecordingRecommender(100)
+    references = {doc_id: [doc_id - 1] for doc_id in range(1, 100)}
+    # room for the scores of 10 documents against the 100 documents
+    report = evaluation.evaluate(recommender, references=references,
+                                 sample_size=None, ks=(1,), num_workers=1,
+                                 memory_limit=10 * 100 * SCORE_BYTES_PER_CELL)
+    assert recommender.batches == [10] * 9 + [9]
+    assert report['num_docs'] == 99
+    assert report['metrics']['MAP'] == 1.0
+
+
+def main():
+    ranking_metrics_test()
+    late_and_missing_hits_test()
+    score_ranking_test()
+    memory_limited_batches_test()
+    print 'evaluation tests passed'
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from citemachine.corpus.facets import FacetIndex, Facets
+
+
+AUTHORS = {7: ['Smith', 'Jones'],
+           3: 'Jones',
+           5: ['M\xc3\xbcller', ' ', 'Smith '],
+           9: None}
+
+
+def facet_index_test():
+    index = FacetIndex(AUTHORS)
+
+    assert len(index) == 3
+    assert index.doc_ids.tolist() == [3, 5, 7, 9]
+    # value ids follow the sorted order of the values
+    assert [index.value(i) for i in range(3)] == [u'Jones', u'M\xfcller',
+                                                  u'Smith']
+    assert index.value_id('Smith') == 2
+    assert 'Jones' in index and 'Nobody' not in index and '' not in index
+    assert u'M\xfcller' in index
+
+    assert index.rows_with('Smith').tolist() == [1, 2]
+    assert index.rows_with('Jones').tolist() == [0, 2]
+    assert index.rows_with('Nobody').tolist() == []
+    assert index.values_of(7) == [u'Jones', u'Smith']
+    assert index.values_of(9) == []
+    assert index.rows_of([9, 4, 3, 100]).tolist() == [3, -1, 0, -1]
+    assert index.mask(['Jones', 'Nobody']).tolist() == [True, False, True,
+                                                       False]
+    try:
+        index.value_id('Nobody')
+    except KeyError:
+        pass
+    else:
+        assert False, 'unknown value has an id'
+
+
+def save_load_test():
+    path = tempfile.mkdtemp()
+    try:
+        index = FacetIndex(AUTHORS)
+        index.save(path)
+        loaded = FacetIndex.load(path)
+
+        assert len(loaded) == len(index)
+        for value in ['Jones', u'M\xfcller', 'Smith', 'Nobody']:
+            assert loaded.rows_with(value).tolist() == \
+                index.rows_with(value).tolist()
+        assert loaded.values_of(5) == index.values_of(5)
+
+        FacetIndex({}).save(path)
+        assert len(FacetIndex.load(path)) == 0
+    finally:
+        shutil.rmtree(path)
+
+
+def facets_test():
+    authors = FacetIndex(AUTHORS)
+    venues = FacetIndex({3: 'VLDB', 5: 'SIGMOD', 7: 'VLDB'})
+    # rows of the topic matrix, 11 is in neither index
+    facets = Facets(authors, venues, [7, 11, 5, 3, 9])
+
+    assert facets.mask() is None
+    assert facets.mask(venues=['VLDB']).tolist() == [True, False, False,
+                                                     True, False]
+    assert facets.mask(exclude_authors=['Smith']).tolist() == \
+        [False, True, False, True, True]
+    assert facets.mask(venues=['VLDB', 'SIGMOD'],
+                       exclude_authors=['Jones']).tolist() == \
+        [False, False, True, False, False]
+    assert not facets.mask(venues=[]).any()
+
+    assert facets.weights() is None
+    weights = facets.weights(boost_venues=['SIGMOD'], venue_boost=2.0)
+    assert weights.tolist() == [1.0, 1.0, 2.0, 1.0, 1.0]
+
+    # a bare string would otherwise be matched character by character
+    for filters in [{'venues': 'VLDB'}, {'exclude_authors': u'Smith'}]:
+        try:
+            facets.mask(**filters)
+        except TypeError:
+            pass
+        else:
+            assert False, 'string accepted as a list of values'
+    try:
+        facets.weights(boost_venues='VLDB')
+    except TypeError:
+        pass
+    else:
+        assert False, 'string accepted as a list of values'
+
+
+def main():
+    facet_index_test()
+    save_load_test()
+    facets_test()
+    print 'facets tests passed'
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+from __future__ import division
+
+import os
+import sys
+
+import networkx as nx
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from citemachine.graph import CitationGraph
+
+
+def small_graph():
+    """Citation chain 0 -> 1 -> 2 -> 3 plus 0 -> 2, with 3 dangling"""
+    graph = nx.DiGraph()
+    graph.add_edges_from([(0, 1), (1, 2), (2, 3), (0, 2)])
+    return CitationGraph(graph)
+
+
+def transition_test():
+    graph = small_graph()
+    assert graph.dangling.tolist() == [False, False, False, True]
+    # columns of the transposed transition matrix of non dangling nodes sum
+    # to one
+    column_sums = np.asarray(graph.transition.sum(axis=0)).ravel()
+    assert np.allclose(column_sums, [1, 1, 1, 0])
+
+
+def pagerank_convergence_test():
+    graph = small_graph()
+    ranks, stats = graph.personalized_pagerank([(0, 1.0)], max_iter=200,
+                                               tol=1e-10)
+    assert stats['converged']
+    assert not stats['budget_exhausted']
+    assert 1 < stats['iterations'] < 200
+    assert stats['residual'] < 1e-10
+    assert np.isclose(ranks.sum(), 1)
+
+    # restarts go to the seed and mass flows down the chain
+    ranked = [node for node, _ in graph.top_ranked(ranks, 4)]
+    assert ranked[0] == 0
+    assert set(ranked) == set([0, 1, 2, 3])
+
+
+def pagerank_max_iter_test():
+    graph = small_graph()
+    _, stats = graph.personalized_pagerank([(0, 1.0)], max_iter=2, tol=0)
+    assert stats['iterations'] == 2
+    assert not stats['converged']
+    assert not stats['budget_exhausted']
+
+
+def pagerank_time_budget_test():
+    graph = small_graph()
+    _, stats = graph.personalized_pagerank([(0, 1.0)], max_iter=50, tol=0,
+                                           time_budget=0)
+    # at least one iteration is always run
+    assert stats['iterations'] == 1
+    assert stats['budget_exhausted']
+    assert not stats['converged']
+
+
+def pagerank_unknown_seeds_test():
+    graph = small_graph()
+    ranks, stats = graph.personalized_pagerank([('missing', 1.0)])
+    assert stats['iterations'] == 0
+    assert not ranks.any()
+    assert graph.top_ranked(ranks, 3) == []
+
+
+def main():
+    transition_test()
+    pagerank_convergence_test()
+    pagerank_max_iter_test()
+    pagerank_time_budget_test()
+    pagerank_unknown_seeds_test()
+    print 'graph tests passed'
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+from __future__ import division
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from citemachine import instrument
+
+
+class FailingSink(object):
+
+    def emit(self, record):
+        raise AssertionError('recorded after the sink was removed')
+
+
+def _parse_counts(result, num_docs, extra=0):
+    return {'docs': num_docs, 'results': len(result) + extra}
+
+
+@instrument.instrumented('parse', counts=_parse_counts)
+def parse(num_docs, extra=0):
+    with instrument.stage('tokenize') as current:
+        current.count(tokens=10)
+        current.count(tokens=5)
+    query(num_docs)
+    return range(num_docs)
+
+
+@instrument.timed('query')
+def query(value):
+    return value * 2
+
+
+def no_sink_test():
+    instrument.set_sink(FailingSink())
+    instrument.set_sink(None)
+    assert not instrument.is_enabled()
+    with instrument.stage('unrecorded') as current:
+        current.count(docs=1)
+    assert parse(3) == [0, 1, 2]
+    assert query(2) == 4
+
+
+def registry_test():
+    registry = instrument.RegistrySink()
+    instrument.set_sink(registry)
+    try:
+        assert instrument.get_sink() is registry
+        parse(4, extra=1)
+        query(1)
+    finally:
+        instrument.set_sink(None)
+
+    summary = registry.summary()
+    # the inner stage ends first, one level below the outer one
+    tokenize, outer = summary['stages']
+    assert (tokenize['name'], tokenize['depth']) == ('tokenize', 1)
+    assert tokenize['counts'] == {'tokens': 15}
+    assert (outer['name'], outer['depth']) == ('parse', 0)
+    assert outer['counts'] == {'docs': 4, 'results': 5}
+    assert outer['wall_time'] >= tokenize['wall_time']
+    assert outer['peak_memory'] > 0
+
+    timing = summary['timings']['query']
+    assert timing['count'] == 2
+    assert timing['min'] <= timing['mean'] <= timing['max']
+    assert abs(timing['mean'] * 2 - timing['total']) < 1e-9
+
+    registry.clear()
+    assert registry.summary() == {'stages': [], 'timings': {}}
+
+
+def failing_call_test():
+    registry = instrument.RegistrySink()
+    instrument.set_sink(registry)
+    try:
+        with instrument.stage('failing'):
+            query(None)
+    except TypeError:
+        pass
+    else:
+        assert False, 'the error was swallowed'
+    finally:
+        instrument.set_sink(None)
+
+    summary = registry.summary()
+    assert [stage['name'] for stage in summary['stages']] == ['failing']
+    assert summary['timings']['query']['count'] == 1
+
+    # the depth is restored after the error
+    registry = instrument.RegistrySink()
+    instrument.set_sink(registry)
+    try:
+        parse(1)
+    finally:
+        instrument.set_sink(None)
+    assert registry.summary()['stages'][-1]['depth'] == 0
+
+
+def json_lines_test():
+    path = tempfile.mkdtemp()
+    try:
+        log_path = os.path.join(path, 'records.jsonl')
+        sink = instrument.JSONLinesSink(log_path)
+        instrument.set_sink(sink)
+        try:
+            parse(2)
+        finally:
+            instrument.set_sink(None)
+            sink.close()
+
+        with open(log_path) as log_file:
+            records = [json.loads(line) for line in log_file]
+        assert [(record['type'], record['name']) for record in records] == \
+            [('stage', 'tokenize'), ('timing', 'query'), ('stage', 'parse')]
+        assert all('timestamp' in record for record in records)
+        assert records[2]['counts'] == {'docs': 2, 'results': 2}
+    finally:
+        shutil.rmtree(path)
+
+
+def main():
+    no_sink_test()
+    registry_test()
+    failing_call_test()
+    json_lines_test()
+    print 'instrument tests passed'
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+from __future__ import division
+
+import os
+import shutil
+import sys
+import tempfile
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from citemachine import neighbours, topic_model
+from citemachine.neighbours import build_neighbour_table, NeighbourTable
+
+
+class TopicMatrixRecommender(object):
+    """Minimal recommender exposing what build_neighbour_table reads"""
+
+    def __init__(self, doc_ids, topic_matrix, years, citation_counts):
+        self.num_topics = topic_matrix.shape[1]
+        self.topic_matrix = (doc_ids, None, topic_matrix)
+        self.filter_columns = (np.asarray(years), np.asarray(citation_counts))
+
+
+def small_recommender(seed=0, num_docs=30, num_topics=5):
+    random = np.random.RandomState(seed)
+    topic_matrix = random.dirichlet(np.ones(num_topics), num_docs)
+    doc_ids = range(100, 100 + num_docs)
+    years = random.randint(1990, 2000, num_docs)
+    citation_counts = random.randint(0, 3, num_docs)
+    return TopicMatrixRecommender(doc_ids, topic_matrix.astype(np.float32),
+                                  years, citation_counts)
+
+
+def fingerprint_test():
+    recommender = small_recommender()
+    doc_ids, _, matrix = recommender.topic_matrix
+    years, citation_counts = recommender.filter_columns
+    digest = neighbours.fingerprint(doc_ids, matrix, years, citation_counts)
+
+    # independent of the row order
+    order = np.arange(len(doc_ids))[::-1]
+    assert digest == neighbours.fingerprint(np.asarray(doc_ids)[order],
+                                            matrix[order], years[order],
+                                            citation_counts[order])
+
+    changed = matrix.copy()
+    changed[3, 0] += 0.1
+    assert digest != neighbours.fingerprint(doc_ids, changed, years,
+                                            citation_counts)
+
+
+def stale_and_incomplete_table_test():
+    path = tempfile.mkdtemp()
+    try:
+        table_path = os.path.join(path, 'table')
+        recommender = small_recommender()
+        table = build_neighbour_table(recommender, table_path, k=5,
+                                      memory_limit=2000, num_workers=1)
+        assert table.manifest['num_blocks'] > 1
+        assert table.is_complete
+
+        # a retrained model does not resume the old table
+        retrained = small_recommender(seed=1)
+        try:
+            build_neighbour_table(retrained, table_path, k=5,
+                                  memory_limit=2000, num_workers=1)
+        except ValueError:
+            pass
+        else:
+            assert False, 'stale table was resumed'
+        try:
+            table.verify(_fingerprint(retrained))
+        except ValueError:
+            pass
+        else:
+            assert False, 'stale table was accepted'
+
+        table = build_neighbour_table(retrained, table_path, k=5,
+                                      memory_limit=2000, num_workers=1,
+                                      overwrite=True)
+        table.verify(_fingerprint(retrained))
+
+        # an interrupted build is refused until it is resumed
+        progress_path = os.path.join(table_path, neighbours.PROGRESS_FILE)
+        with open(progress_path) as progress:
+            completed = progress.readlines()
+        with open(progress_path, 'w') as progress:
+            progress.writelines(completed[:1])
+        try:
+            NeighbourTable(table_path).verify(_fingerprint(retrained))
+        except ValueError:
+            pass
+        else:
+            assert False, 'incomplete table was accepted'
+
+        table = build_neighbour_table(retrained, table_path, k=5,
+                                      memory_limit=2000, num_workers=1)
+        table.verify(_fingerprint(retrained))
+    finally:
+        shutil.rmtree(path)
+
+
+def lookup_matches_live_ranking_test():
+    # few distinct topic vectors, so many documents tie at the kth score
+    random = np.random.RandomState(2)
+    prototypes = random.dirichlet(np.ones(4), 3).astype(np.float32)
+    num_docs = 60
+    recommender = TopicMatrixRecommender(
+        range(num_docs), prototypes[random.randint(0, 3, num_docs)],
+        random.randint(1990, 2000, num_docs), np.ones(num_docs))
+    doc_ids, _, matrix = recommender.topic_matrix
+    years, citation_counts = recommender.filter_columns
+
+    path = tempfile.mkdtemp()
+    try:
+        table = build_neighbour_table(recommender, path, k=8,
+                                      memory_limit=5000, num_workers=1)
+        for row, doc_id in enumerate(doc_ids):
+            live = topic_model.top_scoring_batch(
+                matrix[[row]], matrix, doc_ids, years, citation_counts,
+                topic_model.document_year_cutoffs(years[[row]]), 5)[0]
+            assert table.lookup(doc_id, 5) == live
+    finally:
+        shutil.rmtree(path)
+
+
+def _fingerprint(recommender):
+    doc_ids, _, matrix = recommender.topic_matrix
+    years, citation_counts = recommender.filter_columns
+    return neighbours.fingerprint(doc_ids, matrix, years, citation_counts)
+
+
+def main():
+    fingerprint_test()
+    stale_and_incomplete_table_test()
+    lookup_matches_live_ranking_test()
+    print 'neighbours tests passed'
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+from __future__ import division
+
+import os
+import sys
+import time
+from collections import defaultdict
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bundle_test import trained_recommender
+from citemachine.graph import (CitationGraph, CommunityRank,
+                               adj_lists_to_directed_graph)
+from citemachine import topic_model
+from citemachine.recommender import CiteMachine
+
+
+class FixedCommunityRank(CommunityRank):
+    """CommunityRank over given communities instead of detected ones, its
+    citation graph takes build_time seconds to build"""
+
+    def __init__(self, directed_graph, communities, build_time=0.0):
+        self.directed_graph = directed_graph
+        self.build_time = build_time
+        self.community_graphs = self._build_community_graphs(communities)
+        self.community_rankings = self._pagerank_communities(
+            self.community_graphs)
+
+    @property
+    def citation_graph(self):
+        if getattr(self, '_citation_graph', None) is None:
+            time.sleep(self.build_time)
+            self._citation_graph = CitationGraph(self.directed_graph)
+        return self._citation_graph
+
+
+def group_communities(corpus):
+    """The four groups of the tiny corpus as communities"""
+    communities = {}
+    for doc_id in corpus.keys():
+        communities.setdefault(doc_id % 4, set()).add(doc_id)
+    return communities
+
+
+class CountingLDA(object):
+    """Stub LDA whose topic t is the share of the words with an id equal to
+    t modulo the number of topics, the same through both inference paths"""
+
+    minimum_probability = 0.01
+
+    def __init__(self, num_topics):
+        self.num_topics = num_topics
+
+    def inference(self, bows):
+        gamma = np.ones((len(bows), self.num_topics))
+        for row, bow in enumerate(bows):
+            for word_id, count in bow:
+                gamma[row, word_id % self.num_topics] += count
+        return gamma, None
+
+    def __getitem__(self, bow):
+        gamma = self.inference([bow])[0][0]
+        return [(topic, prob) for topic, prob
+                in enumerate((gamma / gamma.sum()).tolist())
+                if prob >= self.minimum_probability]
+
+
+def per_community_topics(recommender, community_graphs):
+    """Community topics the way they were computed before the sparse
+    product, one word count loop and inference per community"""
+    number_encodings = recommender.preprocessor.number_encodings
+    community_topics = {}
+    for com_id in community_graphs:
+        community_word_counts = defaultdict(int)
+        for doc in community_graphs[com_id].nodes():
+            for word_id, count in number_encodings[doc]:
+                community_word_counts[word_id] += count
+        community_topics[com_id] = \
+            recommender.LDA[community_word_counts.items()]
+    return community_topics
+
+
+def assert_same_topics(community_topics, expected, num_topics):
+    assert sorted(community_topics) == sorted(expected)
+    for com_id in expected:
+        assert np.allclose(
+            topic_model.topics_to_dense(community_topics[com_id], num_topics),
+            topic_model.topics_to_dense(expected[com_id], num_topics))
+
+
+def community_topics_test():
+    recommender = trained_recommender()
+    recommender.LDA = CountingLDA(recommender.num_topics)
+    corpus = recommender.corpus
+    communityrank = FixedCommunityRank(
+        adj_lists_to_directed_graph(corpus.references),
+        group_communities(corpus))
+
+    machine = CiteMachine(recommender, communityrank)
+    assert_same_topics(machine.community_topics,
+                       per_community_topics(recommender,
+                                            communityrank.community_graphs),
+                       recommender.num_topics)
+
+    # community 0 is removed, 1 shrinks and 4 is added
+    graphs = communityrank.community_graphs
+    directed_graph = communityrank.directed_graph
+    del graphs[0]
+    graphs[1] = directed_graph.subgraph(range(1, 60, 4))
+    graphs[4] = directed_graph.subgraph(range(0, 120, 5))
+    machine.update_community_topics([0, 1, 4])
+
+    assert_same_topics(machine.community_topics,
+                       per_community_topics(recommender, graphs),
+                       recommender.num_topics)
+    ranked = machine.rank_communities_by_topics(
+        machine.community_topics[4])
+    assert sorted(com_id for com_id, score in ranked) == [1, 2, 3, 4]
+    assert ranked[0][0] == 4
+
+
+def citation_graph_budget_test(recommender):
+    corpus = recommender.corpus
+    communityrank = FixedCommunityRank(
+        adj_lists_to_directed_graph(corpus.references),
+        group_communities(corpus), build_time=0.05)
+
+    machine = CiteMachine(recommender, communityrank)
+    results, stats = machine.get_personalized_docs_for_text(
+        corpus[3], num_results=5, max_iter=50, time_budget=None)
+    assert len(results) == 5
+    assert stats['graph_time'] < 0.05
+
+    # a graph that still has to be built uses up the query's budget
+    communityrank._citation_graph = None
+    results, stats = machine.get_personalized_docs_for_text(
+        corpus[3], num_results=5, max_iter=50, time_budget=0.02)
+    assert stats['graph_time'] >= 0.05
+    assert stats['iterations'] == 1 and stats['budget_exhausted']
+
+
+def main():
+    recommender = trained_recommender()
+    citation_graph_budget_test(recommender)
+    community_topics_test()
+    print 'recommender tests passed'
+
+
+if __name__ == '__main__':
+    main()
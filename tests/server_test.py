@@ -0,0 +1,80 @@
+from __future__ import division
+
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from citemachine.server import LatencyStats, MicroBatcher, validate_query
+
+
+def invalid(query):
+    try:
+        validate_query(query)
+    except ValueError:
+        return True
+    return False
+
+
+def validate_query_test():
+    assert validate_query({'text': 'a', 'year': 2010, 'num_results': 5})
+    assert validate_query({'text': 'a', 'year': None})
+
+    assert invalid(['text'])
+    assert invalid('text')
+    assert invalid({'year': 2010})
+    assert invalid({'text': 'a', 'year': '2010'})
+    assert invalid({'text': 'a', 'year': True})
+    assert invalid({'text': 'a', 'num_results': 'ten'})
+    assert invalid({'text': 'a', 'num_results': 0})
+    assert invalid({'text': 'a', 'num_results': 2.5})
+    assert validate_query({'text': 'a', 'venues': [u'VLDB', 'SIGMOD'],
+                           'exclude_authors': []})
+    assert invalid({'text': 'a', 'venues': 'VLDB'})
+    assert invalid({'text': 'a', 'venues': [['VLDB']]})
+    assert invalid({'text': 'a', 'boost_venues': [1]})
+
+
+def bad_query_isolated_test():
+    def process_batch(queries):
+        if any(query['text'] == 'bad' for query in queries):
+            raise KeyError('bad')
+        return [query['text'].upper() for query in queries]
+
+    stats = LatencyStats()
+    # a long wait gathers all submitted queries into one batch
+    batcher = MicroBatcher(process_batch, stats, max_batch_size=3,
+                           max_wait=0.5)
+    results = {}
+
+    def submit(text):
+        try:
+            results[text] = batcher.submit({'text': text}, timeout=10)
+        except KeyError as error:
+            results[text] = error
+
+    threads = [threading.Thread(target=submit, args=(text,))
+               for text in ('a', 'bad', 'b')]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    batcher.close()
+
+    assert results['a'] == 'A'
+    assert results['b'] == 'B'
+    assert isinstance(results['bad'], KeyError)
+    counters = stats.snapshot()['counters']
+    assert counters['errors'] == 1
+    assert counters['batch_retries'] == 1
+
+
+def main():
+    validate_query_test()
+    bad_query_isolated_test()
+    print 'server tests passed'
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+from __future__ import division
+
+import os
+import sys
+
+import numpy as np
+import scipy.sparse as sp
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from citemachine import evaluation, sweep, topic_model
+from citemachine.bundle import BundleReferences
+
+
+def sweep_data(matrix):
+    return {'num_docs': matrix.shape[0], 'vocabulary_size': matrix.shape[1],
+            'data': matrix.data, 'indices': matrix.indices,
+            'indptr': matrix.indptr}
+
+
+def sweep_corpus_test():
+    matrix = sp.csr_matrix(np.array([[1, 0, 2, 0, 3],
+                                     [0, 4, 0, 0, 0],
+                                     [5, 6, 7, 8, 9]]))
+    kept_words = np.array([0, 2, 4])
+    corpus = sweep.SweepCorpus(sweep_data(matrix), kept_words)
+
+    expected = topic_model.sparse_rows_to_bows(
+        matrix[:, kept_words].tocsr().sorted_indices())
+    assert len(corpus) == 3
+    assert list(corpus) == expected
+    assert corpus[1] == []
+    assert corpus[1:] == expected[1:]
+
+
+def sweep_recommender_test():
+    # two groups of documents with disjoint topics, citing within the group
+    topic_matrix = np.array([[0.9, 0.1], [0.8, 0.2], [0.1, 0.9],
+                             [0.2, 0.8]], dtype=np.float32)
+    years = np.array([2000, 2000, 0, 2003])
+    recommender = sweep.SweepRecommender(topic_matrix, years,
+                                         np.ones(4, dtype=np.int64))
+    references = BundleReferences(recommender.rows, np.array([0, 1, 2, 3, 4]),
+                                  np.array([1, 0, 3, 2]))
+
+    results = recommender.top_scoring_for_docs([0, 2], 2)
+    assert [doc for doc, score in results[0]] == [0, 1]
+    # an unknown year does not hide the newer documents
+    assert [doc for doc, score in results[1]] == [2, 3]
+
+    report = evaluation.evaluate(recommender, doc_ids=[0, 1, 2, 3],
+                                 references=references, sample_size=None,
+                                 ks=(1,), num_workers=1)
+    assert report['num_docs'] == 4
+    assert report['metrics']['MAP'] == 1.0
+
+
+def unknown_rank_by_test():
+    try:
+        sweep.run_sweep('does-not-exist', [], ks=(5,), rank_by='nDCG@10')
+    except ValueError:
+        pass
+    else:
+        assert False, 'rank_by must be one of the metrics of ks'
+
+
+def main():
+    sweep_corpus_test()
+    sweep_recommender_test()
+    unknown_rank_by_test()
+    print 'sweep tests passed'
+
+
+if __name__ == '__main__':
+    main()
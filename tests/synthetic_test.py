@@ -0,0 +1,58 @@
+import filecmp
+import os
+import shutil
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from citemachine.corpus.dblp import DBLP
+from citemachine.corpus.synthetic import generate_dblp
+
+
+def deterministic_test():
+    path = tempfile.mkdtemp()
+    try:
+        first = os.path.join(path, 'first.txt')
+        second = os.path.join(path, 'second.txt')
+        other = os.path.join(path, 'other.txt')
+        generate_dblp(first, num_docs=200, num_topics=5, seed=1)
+        generate_dblp(second, num_docs=200, num_topics=5, seed=1)
+        generate_dblp(other, num_docs=200, num_topics=5, seed=2)
+        assert filecmp.cmp(first, second, shallow=False)
+        assert not filecmp.cmp(first, other, shallow=False)
+    finally:
+        shutil.rmtree(path)
+
+
+def parsed_corpus_test():
+    path = tempfile.mkdtemp()
+    try:
+        src = os.path.join(path, 'dblp.txt')
+        generate_dblp(src, num_docs=300, num_topics=5, seed=0)
+        corpus = DBLP(src)
+
+        assert 0 < len(corpus.titles) <= 300
+        for doc_id, refs in corpus.references.items():
+            assert all(ref in corpus.titles for ref in refs)
+            assert corpus.abstracts[doc_id]
+
+        author_index = corpus.author_index
+        for doc_id in sorted(corpus.titles)[:20]:
+            authors = [author.strip() for author in corpus.authors[doc_id]]
+            assert sorted(author_index.values_of(doc_id)) == \
+                sorted(set(author.decode('utf-8') for author in authors))
+            assert corpus.venue_index.values_of(doc_id) == \
+                [corpus.conferences[doc_id].strip().decode('utf-8')]
+    finally:
+        shutil.rmtree(path)
+
+
+def main():
+    deterministic_test()
+    parsed_corpus_test()
+    print 'synthetic tests passed'
+
+
+if __name__ == '__main__':
+    main()
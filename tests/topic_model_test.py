@@ -0,0 +1,91 @@
+from __future__ import division
+
+import os
+import sys
+from datetime import date
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from citemachine import topic_model
+
+
+def sparse_rows_round_trip_test():
+    bows = [[(0, 2), (3, 1)], [], [(1, 5)]]
+    matrix = topic_model.bows_to_sparse_rows(bows, 4)
+    assert matrix.shape == (3, 4)
+    assert matrix.toarray().tolist() == [[2, 0, 0, 1], [0, 0, 0, 0],
+                                         [0, 5, 0, 0]]
+    assert topic_model.sparse_rows_to_bows(matrix) == bows
+
+
+def top_k_ordering_test():
+    scores = np.array([0.1, 0.9, 0.5, 0.7, 0.3])
+    assert topic_model.top_k_indices(scores, 3).tolist() == [1, 3, 2]
+    assert topic_model.top_k_indices(scores, 10).tolist() == [1, 3, 2, 4, 0]
+    assert topic_model.top_k_indices(scores, 0).tolist() == []
+
+
+def top_k_ties_test():
+    scores = np.array([0.5, 0.2, 0.5, 0.9, 0.5, 0.5])
+    # ties are broken by the lower index, also across the kth position
+    assert topic_model.top_k_indices(scores, 3).tolist() == [3, 0, 2]
+    assert topic_model.top_k_indices(scores, 5).tolist() == [3, 0, 2, 4, 5]
+
+    scores = np.array([-np.inf, 1.0, -np.inf])
+    assert topic_model.top_k_indices(scores, 2).tolist() == [1, 0]
+
+
+def histogram_intersection_test():
+    query = np.array([0.5, 0.5, 0.0], dtype=np.float32)
+    topic_matrix = np.array([[0.5, 0.5, 0.0],
+                             [0.0, 0.2, 0.8],
+                             [1.0, 0.0, 0.0]], dtype=np.float32)
+    scores = topic_model.histogram_intersection_scores(query, topic_matrix)
+    assert np.allclose(scores, [1.0, 0.2, 0.5])
+
+    block = topic_model.histogram_intersection_block(topic_matrix[:2],
+                                                     topic_matrix)
+    assert np.allclose(block[0], scores)
+    # the intersection is symmetric
+    assert np.allclose(block[:, :2], block[:, :2].T)
+
+
+def year_cutoffs_test():
+    this_year = date.today().year
+    assert topic_model.year_cutoffs(None, 2) == [this_year, this_year]
+    assert topic_model.year_cutoffs([2001, None], 2) == [2001, this_year]
+    # unknown document years are stored as 0 in the filter columns
+    cutoffs = topic_model.document_year_cutoffs(np.array([1999, 0]))
+    assert cutoffs.tolist() == [1999, this_year]
+
+
+def top_scoring_batch_years_test():
+    topic_matrix = np.array([[1.0, 0.0], [0.7, 0.3], [0.5, 0.5]],
+                            dtype=np.float32)
+    years = np.array([2000, 2005, 0])
+    citation_counts = np.array([1, 1, 1])
+    cutoffs = topic_model.document_year_cutoffs(years)
+    results = topic_model.top_scoring_batch(topic_matrix, topic_matrix,
+                                            [10, 11, 12], years,
+                                            citation_counts, cutoffs, 3)
+    # documents from later years are filtered out, the document without a
+    # year is a query for the current year and a candidate for every query
+    assert [doc for doc, _ in results[0]] == [10, 12]
+    assert [doc for doc, _ in results[1]] == [11, 12, 10]
+    assert [doc for doc, _ in results[2]] == [12, 11, 10]
+
+
+def main():
+    sparse_rows_round_trip_test()
+    top_k_ordering_test()
+    top_k_ties_test()
+    histogram_intersection_test()
+    year_cutoffs_test()
+    top_scoring_batch_years_test()
+    print 'topic_model tests passed'
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+from __future__ import division
+
+import cPickle
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from citemachine.util import LRUCache
+
+
+def lru_eviction_order_test():
+    cache = LRUCache(2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    # reading 'a' makes 'b' the least recently used item
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+    assert 'b' not in cache
+    assert 'a' in cache and 'c' in cache
+    assert len(cache) == 2
+
+    # overwriting refreshes an item as well
+    cache.put('a', 10)
+    cache.put('d', 4)
+    assert 'c' not in cache
+    assert cache.get('a') == 10
+
+
+def lru_hit_rate_test():
+    cache = LRUCache(4)
+    assert cache.hit_rate == 0.0
+    cache.put('a', 1)
+    cache.get('a')
+    cache.get('a')
+    assert cache.get('missing', 'default') == 'default'
+    assert cache.hits == 2 and cache.misses == 1
+    assert abs(cache.hit_rate - 2 / 3) < 1e-12
+
+    stats = cache.stats()
+    assert stats['size'] == 1 and stats['maxsize'] == 4
+
+    cache.clear()
+    assert len(cache) == 0
+    assert cache.hits == 0 and cache.misses == 0
+
+
+def lru_disabled_test():
+    cache = LRUCache(0)
+    cache.put('a', 1)
+    assert len(cache) == 0
+    assert cache.get('a') is None
+
+
+def lru_threads_test():
+    cache = LRUCache(8)
+    errors = []
+
+    def worker(offset):
+        try:
+            for i in range(20000):
+                key = (i * 7 + offset) % 32
+                if cache.get(key) is None:
+                    cache.put(key, i)
+        except Exception as error:
+            errors.append(error)
+
+    threads = [threading.Thread(target=worker, args=(offset,))
+               for offset in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    assert len(cache) == 8
+    assert cache.hits + cache.misses == 4 * 20000
+
+
+def lru_pickle_test():
+    cache = LRUCache(2)
+    cache.put('a', 1)
+    restored = cPickle.loads(cPickle.dumps(cache, 2))
+    assert restored.get('a') == 1
+    restored.put('b', 2)
+    restored.put('c', 3)
+    assert 'a' not in restored
+
+
+def main():
+    lru_eviction_order_test()
+    lru_hit_rate_test()
+    lru_disabled_test()
+    lru_threads_test()
+    lru_pickle_test()
+    print 'util tests passed'
+
+
+if __name__ == '__main__':
+    main()